@@ -1,24 +1,48 @@
 # align.py by Michael Wilson
 # Based on transcription_extraction.py, gentle_align.sh, and gentle2r.py by Shota Momma
 # Last update 12/13/2022
+import io
 import os
 import re
 import sys
 import json
+import wave
+import math
 import time
+import random
 import glob
+import hashlib
+import shlex
 import shutil
 import ctypes
 import logging
 import requests
 import argparse
+import threading
 import traceback
 import subprocess
 
+import numpy as np
 import pandas as pd
 
 from tqdm import tqdm
 from typing import *
+from functools import partial
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+	import pyarrow.feather as feather
+except ImportError:
+	pa = None
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -60,6 +84,14 @@ parser.add_argument(
 	'-m', '--max_words', default=20, type=int,
 	help='Optional argument to specify the maximum number of words in a sentence. Default is 20.'
 )
+parser.add_argument(
+	'-f', '--output_format', default='csv', choices=['csv', 'parquet', 'feather'],
+	help=(
+		"Optional argument to specify how to save durations. 'csv' (the default) adds one column per word "
+		"to the stimuli file, up to --max_words. 'parquet' and 'feather' save one row per word with no "
+		"maximum to a separate compressed file in the sound directory (requires pyarrow)."
+	)
+)
 parser.add_argument(
 	'-p', '--port', default=8765, type=int,
 	help="Optional argument to specify the port used for gentle. Default is 8765. This cannot be changed on a Mac currently. (You probably don't need to mess with this.)"
@@ -75,91 +107,549 @@ parser.add_argument(
 parser.add_argument(
 	'-w', '--wait', default=75, type=int,
 	help=(
-		'Optional argument for how long to wait after starting Docker Desktop to open gentle. '
-		'Default is 75 seconds. Not used on Mac.'
+		'Optional argument for the longest to wait after starting Docker Desktop for it to be ready to open gentle. '
+		'gentle is opened as soon as Docker is ready. Default is 75 seconds. Not used on Mac.'
+	)
+)
+parser.add_argument(
+	'-j', '--jobs', default=1, type=int,
+	help=(
+		'Optional argument to specify how many alignments to send to gentle at once. '
+		'Default is 1. Setting this to the number of cores gentle can use speeds up alignment.'
+	)
+)
+parser.add_argument(
+	'-e', '--extract_jobs', default=1, type=int,
+	help=(
+		'Optional argument to specify how many processes to use to save TextGrids and get durations '
+		'from the alignments. Default is 1.'
+	)
+)
+parser.add_argument(
+	'-b', '--batch', default=False, action='store_true',
+	help=(
+		"Optional argument to use gentle's asynchronous API: all items are submitted to gentle at once, "
+		'and their results are downloaded as they finish. This keeps many items queued in gentle '
+		'without holding a connection open for each one.'
+	)
+)
+parser.add_argument(
+	'--pipeline', default=False, action='store_true',
+	help=(
+		'Optional argument to overlap the steps of aligning: TextGrids and durations are saved for items '
+		'as soon as gentle finishes them, and the next transcription file is prepared, while gentle is still aligning. '
+		'The output is the same.'
+	)
+)
+parser.add_argument(
+	'-n', '--instances', default=1, type=int,
+	help=(
+		'Optional argument to specify how many gentle instances to start, on consecutive ports '
+		'beginning at --port. Alignments are sent to whichever instance has the least outstanding work. '
+		'Default is 1. Not used on Mac.'
+	)
+)
+parser.add_argument(
+	'-c', '--gentle_command', default='docker run --rm -p {port}:8765 lowerquality/gentle', type=str,
+	help=(
+		'Optional argument to specify the command used to start gentle on Linux. '
+		"'{port}' is replaced by the port for each instance. "
+		"Default is 'docker run --rm -p {port}:8765 lowerquality/gentle'. Only used on Linux."
+	)
+)
+parser.add_argument(
+	'-k', '--keep_alive', default=False, action='store_true',
+	help=(
+		'Optional argument to leave gentle running when finished, so that the next run can use it '
+		'without waiting for it to start. gentle that is already running when align.py starts is always '
+		'used and left running.'
 	)
 )
+parser.add_argument(
+	'--timeout', default=60, type=float,
+	help=(
+		'Optional argument to specify how long (in seconds) to wait for gentle to align an item before '
+		'trying again. Longer recordings are given longer (see --timeout_factor). Default is 60.'
+	)
+)
+parser.add_argument(
+	'--timeout_factor', default=5, type=float,
+	help='Optional argument to specify how many seconds to add to --timeout for each second of audio. Default is 5.'
+)
+parser.add_argument(
+	'--retries', default=2, type=int,
+	help=(
+		'Optional argument to specify how many more times to send an item to gentle if it takes too long or returns '
+		'an error, waiting a random and increasing amount of time before each try. Items that still cannot be aligned '
+		"are listed in failures.csv in the alignment directory. Default is 2."
+	)
+)
+parser.add_argument(
+	'--no_hedge', default=False, action='store_true',
+	help=(
+		'Optional argument to not send a duplicate of slow requests to a second gentle instance. Normally, when more '
+		'than one instance is running, an item that takes longer than 95%% of recent items is also sent to another '
+		'instance, and whichever alignment comes back first is used.'
+	)
+)
+parser.add_argument(
+	'--cache_dir', default=os.path.join(os.path.expanduser('~'), '.cache', 'align'), type=str,
+	help=(
+		'Optional argument to specify where to cache alignments, so that audio and transcriptions '
+		"that haven't changed aren't sent to gentle again. Default is '~/.cache/align'."
+	)
+)
+parser.add_argument(
+	'--cache_size', default=1024, type=int,
+	help=(
+		'Optional argument to specify the maximum size of the alignment cache in MB. '
+		'The least recently used alignments are removed when it gets bigger than this. Default is 1024.'
+	)
+)
+parser.add_argument(
+	'--no_cache', default=False, action='store_true',
+	help='Optional argument to always send files to gentle, without reading from or saving to the alignment cache.'
+)
+parser.add_argument(
+	'--precondition', default=False, action='store_true',
+	help=(
+		'Optional argument to convert each mp3 to 8 kHz mono (what gentle uses) before sending it to gentle, '
+		'which makes uploads smaller and saves gentle from decoding the original. Converted audio is cached '
+		'in --cache_dir. Requires ffmpeg.'
+	)
+)
+parser.add_argument(
+	'--split', default=0, type=float,
+	help=(
+		'Optional argument to split recordings longer than this many seconds at pauses into segments of about this '
+		'length, align the segments at the same time (up to --jobs at once), and put the alignments back together. '
+		'The transcription is split to match. Requires ffmpeg. Default is 0 (never split).'
+	)
+)
+parser.add_argument(
+	'--split_silence', default=0.5, type=float,
+	help='Optional argument to specify how long (in seconds) a pause must be for --split to split there. Default is 0.5.'
+)
+parser.add_argument(
+	'--metrics', nargs='?', const='align_metrics', default=None, type=str,
+	help=(
+		'Optional argument to save how long each step took for each item (with the median, 95th percentile, '
+		'and maximum), and how many bytes were uploaded, retries, and cache hits. These are saved as a JSON '
+		"report to METRICS.json and in Prometheus's text format to METRICS.prom. If no name is given, "
+		"'align_metrics' is used."
+	)
+)
+parser.add_argument(
+	'-r', '--resume', default=False, action='store_true',
+	help=(
+		'Optional argument to continue a previous run. Instead of making a new gentle_align directory, '
+		'only items that are missing, failed, or whose audio or transcription changed are aligned again.'
+	)
+)
+
+def run_in_thread(function: Callable, *args, **kwargs) -> Future:
+	'''
+	Calls function in a new daemon thread, and returns a future for its result.
+	Unlike with a ThreadPoolExecutor, exiting does not wait for it to finish.
+	'''
+	future = Future()
+	def run() -> None:
+		try:
+			future.set_result(function(*args, **kwargs))
+		except BaseException as e:
+			future.set_exception(e)
+	
+	threading.Thread(target=run, daemon=True).start()
+	return future
+
+class GentlePool():
+	'''
+	Keeps track of a set of gentle instances and hands out the healthy
+	instance with the least outstanding work for each request.
+	Requests can be retried with jittered backoff, and slow requests can be 
+	hedged by sending a duplicate to another instance.
+	Instances that can't be reached are checked again with is_gentle_ready (at most every 
+	probe_interval seconds) and put back in the pool once they answer. They are only given up on 
+	after max_probes checks in a row fail.
+	'''
+	def __init__(
+		self, 
+		urls: List[str], 
+		metrics: 'Metrics' = None, 
+		hedge_quantile: float = 0.95, 
+		hedge_min_requests: int = 20,
+		max_probes: int = 3,
+		probe_interval: float = 2
+	):
+		self.urls = urls
+		self.metrics = metrics
+		self.outstanding = {url: 0 for url in urls}
+		self.healthy = {url: True for url in urls}
+		self.lock = threading.Lock()
+		
+		# how many checks in a row each unhealthy instance has failed, and when it can be checked next
+		self.max_probes = max_probes
+		self.probe_interval = probe_interval
+		self.failed_probes = {url: 0 for url in urls}
+		self.next_probe = {url: 0. for url in urls}
+		
+		# how long recent successful requests took, to decide when to hedge
+		self.hedge_quantile = hedge_quantile
+		self.hedge_min_requests = hedge_min_requests
+		self.latencies = deque(maxlen=1000)
+	
+	def acquire(self, exclude: Container[str] = ()) -> str:
+		'''
+		Reserves the healthy instance with the fewest requests in flight, other than those in exclude.
+		Unhealthy instances that are due to be checked again are checked first. If none are healthy, 
+		this waits until they answer again or are given up on.
+		'''
+		while True:
+			self.probe(exclude=exclude)
+			with self.lock:
+				healthy = [url for url in self.urls if self.healthy[url] and not url in exclude]
+				if healthy:
+					url = min(healthy, key=lambda url: self.outstanding[url])
+					self.outstanding[url] += 1
+					return url
+				
+				next_probes = [
+					self.next_probe[url] for url in self.urls 
+					if not url in exclude and self.failed_probes[url] < self.max_probes
+				]
+			
+			if not next_probes:
+				raise requests.exceptions.ConnectionError('No healthy gentle instances are available.')
+			
+			time.sleep(max(0, min(next_probes) - time.monotonic()))
+	
+	def release(self, url: str, healthy: bool = True) -> None:
+		'''Returns an instance to the pool, marking it unhealthy if it could not be reached.'''
+		with self.lock:
+			self.outstanding[url] -= 1
+			if not healthy and self.healthy[url]:
+				self.healthy[url] = False
+				self.next_probe[url] = 0.
+	
+	def probe(self, exclude: Container[str] = ()) -> None:
+		'''
+		Checks whether unhealthy instances (other than those in exclude) are answering again, 
+		and puts them back in the pool if they are. Each instance is checked by one thread at a time, 
+		at most every probe_interval seconds, and is given up on after max_probes failed checks in a row.
+		'''
+		for url in self.urls:
+			with self.lock:
+				now = time.monotonic()
+				if (
+					self.healthy[url] or url in exclude or 
+					self.failed_probes[url] >= self.max_probes or now < self.next_probe[url]
+				):
+					continue
+				
+				self.next_probe[url] = now + self.probe_interval
+			
+			ready = is_gentle_ready(requests.compat.urlsplit(url).port)
+			with self.lock:
+				if ready:
+					self.healthy[url] = True
+					self.failed_probes[url] = 0
+					log.info(f'gentle at {url!r} is answering again.')
+				else:
+					self.failed_probes[url] += 1
+					if self.failed_probes[url] >= self.max_probes:
+						log.warning(f'gentle at {url!r} has not answered {self.max_probes} times in a row. No more requests will be sent to it.')
+	
+	def is_alive(self) -> bool:
+		'''Checks whether any instances are healthy, or unhealthy but not given up on yet.'''
+		with self.lock:
+			return any(self.healthy[url] or self.failed_probes[url] < self.max_probes for url in self.urls)
+	
+	def count(self, counter: str) -> None:
+		'''Counts something in metrics, if there are any.'''
+		if self.metrics is not None:
+			self.metrics.count(counter)
+	
+	def post(self, session: requests.Session, hedge: bool = False, **kwargs) -> requests.Response:
+		'''
+		Posts to the least busy healthy instance. If an instance cannot be reached,
+		it is taken out of the pool until it answers again, and the request is tried again.
+		If hedge is set and more than one instance is healthy, a request that takes longer than
+		hedge_quantile of recent requests is also sent to another instance, and the first successful 
+		response is used. Other keyword arguments are passed to submit.
+		'''
+		delay = self.hedge_delay() if hedge else None
+		if delay is None:
+			url, r = self.request(session, **kwargs)
+			self.release(url)
+			return r
+		
+		# send a duplicate to another instance if the first one takes too long
+		tried = []
+		futures = [run_in_thread(self.request, session, tried=tried, **kwargs)]
+		if not wait(futures, timeout=delay).done:
+			futures.append(run_in_thread(self.request, session, exclude=list(tried), **kwargs))
+			self.count('hedged_requests')
+		
+		# whichever request loses keeps its instance until it finishes
+		for future in futures:
+			future.add_done_callback(self.release_request)
+		
+		response, error = None, None
+		for future in as_completed(futures):
+			try:
+				_, r = future.result()
+			except requests.exceptions.RequestException as e:
+				error = error or e
+				continue
+			
+			if r.ok:
+				if future is not futures[0]:
+					self.count('hedges_won')
+				
+				return r
+			
+			response = response or r
+		
+		if response is None:
+			raise error
+		
+		return response
+	
+	def release_request(self, future: Future) -> None:
+		'''Releases the instance used by a request made with request in another thread once it finishes.'''
+		if future.exception() is None:
+			self.release(future.result()[0])
+	
+	def request(self, session: requests.Session, **kwargs) -> Tuple[str, requests.Response]:
+		'''Like submit, but records how long successful requests take, to decide when to hedge.'''
+		start = time.perf_counter()
+		url, r = self.submit(session, **kwargs)
+		if r.ok:
+			with self.lock:
+				self.latencies.append(time.perf_counter() - start)
+		
+		return url, r
+	
+	def hedge_delay(self) -> Optional[float]:
+		'''
+		Gets how long to wait for a request before hedging it: the hedge_quantile of recent request times.
+		Returns None if there have not been enough requests yet, or fewer than two instances are healthy.
+		'''
+		with self.lock:
+			if sum(self.healthy.values()) < 2 or len(self.latencies) < self.hedge_min_requests:
+				return None
+			
+			latencies = sorted(self.latencies)
+		
+		return latencies[max(0, math.ceil(self.hedge_quantile * len(latencies)) - 1)]
+	
+	def submit(
+		self, 
+		session: requests.Session, 
+		retries: int = 0, 
+		backoff: float = 1, 
+		exclude: Container[str] = (), 
+		tried: List[str] = None, 
+		**kwargs
+	) -> Tuple[str, requests.Response]:
+		'''
+		Like post, but the instance stays reserved after the request finishes, for work that 
+		continues on the instance afterward (like an asynchronous alignment). 
+		Call release with the returned url when that work is done.
+		Requests that time out, can't reach gentle, or get a server error are tried again up to retries times, 
+		waiting a random time of up to backoff, 2 * backoff, 4 * backoff, ... seconds before each try. 
+		If the last try times out or can't reach gentle, the error is raised; if it gets a server error, 
+		that response is returned.
+		Instances in exclude are not used. If tried is provided, each instance used is added to it.
+		'''
+		attempt = 0
+		while True:
+			# rewind any open files so a retry sends the whole thing
+			for file in kwargs.get('files', {}).values():
+				if hasattr(file[1], 'seek'):
+					file[1].seek(0)
+			
+			url = None
+			try:
+				url = self.acquire(exclude=exclude)
+				if tried is not None:
+					tried.append(url)
+				
+				r = session.post(url, **kwargs)
+			except requests.exceptions.ReadTimeout:
+				self.release(url)
+				if attempt >= retries:
+					raise
+				
+				log.warning(f'gentle at {url!r} did not respond within {kwargs.get("timeout")} seconds. Trying again.')
+			except requests.exceptions.ConnectionError:
+				# if no instance could be acquired, they have all been given up on
+				if url is None:
+					raise
+				
+				self.release(url, healthy=False)
+				if attempt >= retries:
+					raise
+				
+				log.warning(f'Unable to reach gentle at {url!r}. Trying again.')
+			except Exception:
+				if url is not None:
+					self.release(url)
+				
+				raise
+			else:
+				if r.status_code < 500 or attempt >= retries:
+					return url, r
+				
+				self.release(url)
+				log.warning(f'gentle at {url!r} returned an error ({r.status_code} {r.reason}). Trying again.')
+			
+			self.count('retries')
+			time.sleep(random.uniform(0, backoff * 2 ** attempt))
+			attempt += 1
 
 class GentleListener():
-	'''Handles opening and closing the lowerquality/gentle application.'''
-	def __init__(self, port: int = 8765, docker_location: str = '', wait: int = 75):
+	'''
+	Handles opening and closing the lowerquality/gentle application.
+	gentle instances that are already running on the requested ports are reused rather than 
+	started again, and are left running afterward. If keep_alive is set, the instances started 
+	here are also left running, so the next run doesn't have to wait for them to start.
+	'''
+	def __init__(
+		self, 
+		port: int = 8765, 
+		docker_location: str = '', 
+		wait: int = 75, 
+		instances: int = 1, 
+		gentle_command: str = 'docker run --rm -p {port}:8765 lowerquality/gentle',
+		keep_alive: bool = False,
+		timeout: float = 60,
+		metrics: 'Metrics' = None
+	):
 		self.port = port
 		self.docker_location = docker_location
 		self.wait = wait
+		self.instances = instances
+		self.gentle_command = gentle_command
+		self.keep_alive = keep_alive
+		self.timeout = timeout
+		self.metrics = metrics
+		self.ports = [port + i for i in range(instances)]
+		self.launched = []
+		self.started_docker = False
+		self.processes = []
 	
-	def __enter__(self):
-		'''Start the gentle listener (os.name == 'nt' is for Windows, else for Mac).'''
-		log.info('Starting gentle listener')
+	def __enter__(self) -> GentlePool:
+		'''
+		Start the gentle listener(s) (os.name == 'nt' is for Windows, 
+		sys.platform == 'darwin' is for Mac, else for Linux).
+		Returns a pool of the instances that started successfully.
+		'''
+		start = time.perf_counter()
+		
+		# Reuse any gentle that is already running
+		self.launched = [port for port in self.ports if not is_gentle_ready(port)]
+		if not self.launched:
+			log.info(f'Using gentle already running on port(s) {", ".join(str(port) for port in self.ports)}')
+			if self.metrics is not None:
+				self.metrics.record('gentle_startup', time.perf_counter() - start)
+			
+			return GentlePool([f'http://localhost:{port}/transcriptions' for port in self.ports], metrics=self.metrics)
+		
+		log.info(f'Starting gentle listener{"s" if len(self.launched) > 1 else ""}')
 		if os.name == 'nt':
-			# can only start the docker service with admin privileges
-			if is_admin():
-				subprocess.call('net start com.docker.service')
-				time.sleep(5)
-			else:
-				log.warning(
-					'Cannot start docker service without admin privileges. '
-					'You may run into issues if the service is not already '
-					'running, or see an admin prompt to start it.'
-				)
-				if (cont := input('Would you like to open an administrator command prompt and continue? (y/n): ')).lower() == 'y':
-					# This addresses an issue when not running using the "python" command but just calling the script
-					sys.argv[0] = os.path.split(sys.argv[0])[1]
-					ctypes.windll.shell32.ShellExecuteW(None, 'runas', sys.executable, ' '.join(sys.argv), None, 1)
-					sys.exit(0)
+			# Only start Docker if it isn't already running
+			if not is_docker_ready():
+				self.started_docker = True
+				# can only start the docker service with admin privileges
+				if is_admin():
+					subprocess.call('net start com.docker.service')
 				else:
-					log.info(
-						'Attempting to continue without admin privileges. '
-						'You may run into permission issues running Docker.'
+					log.warning(
+						'Cannot start docker service without admin privileges. '
+						'You may run into issues if the service is not already '
+						'running, or see an admin prompt to start it.'
 					)
+					if (cont := input('Would you like to open an administrator command prompt and continue? (y/n): ')).lower() == 'y':
+						# This addresses an issue when not running using the "python" command but just calling the script
+						sys.argv[0] = os.path.split(sys.argv[0])[1]
+						ctypes.windll.shell32.ShellExecuteW(None, 'runas', sys.executable, ' '.join(sys.argv), None, 1)
+						sys.exit(0)
+					else:
+						log.info(
+							'Attempting to continue without admin privileges. '
+							'You may run into permission issues running Docker.'
+						)
+				
+				log.info('Opening Docker Desktop, please be patient...')
+				subprocess.Popen(self.docker_location, shell=True)
+				if not poll(is_docker_ready, timeout=self.wait):
+					log.warning(f'Docker did not respond within {self.wait} seconds. Trying to start gentle anyway.')
 			
-			log.info('Opening Docker Desktop, please be patient...')
-			subprocess.Popen(self.docker_location, shell=True)
-			time.sleep(self.wait)
-			subprocess.Popen(f'docker run -p {self.port}:{self.port} lowerquality/gentle')
-		else:
+			for port in self.launched:
+				subprocess.Popen(f'docker run -p {port}:8765 lowerquality/gentle')
+		elif sys.platform == 'darwin':
 			subprocess.Popen('open -a gentle', shell=True)
+		else:
+			for port in self.launched:
+				self.processes.append(subprocess.Popen(shlex.split(self.gentle_command.format(port=port))))
+		
+		# Make sure the listeners have had time to start before we call them
+		waiting = list(self.launched)
+		def all_ready() -> bool:
+			for port in list(waiting):
+				if is_gentle_ready(port):
+					waiting.remove(port)
 			
-		# Make sure the listener has had time to start before we call it
-		failures = 0
-		r = ''
-		while not r or not r.ok:
-			try:
-				r = requests.get(f'http://localhost:{self.port}')
-			except requests.exceptions.ConnectionError:
-				time.sleep(5)
-				failures += 1
-				if failures >= 12:
-					log.error(
-						'Unable to open gentle listener within 1 min. Halting execution. '
-						'For Windows users, is the docker service running?'
-					)
-					# Close docker if on Windows
-					if os.name == 'nt':
-						if is_admin():
-							subprocess.call('powershell net stop com.docker.service')
-							time.sleep(5)
-							subprocess.call(
-								f'taskkill /F /IM "' + 
-								re.findall(r'.*\.exe', os.path.split(self.docker_location)[-1])[0] + 
-								'"'
-							)
-							subprocess.call('powershell stop-vm DockerDesktopVM')
-						else:
-							log.warning(
-								'Docker service and VM cannot be terminated without admin '
-								'privileges. Make sure to manually exit Docker Desktop via the tray menu.'
-							)
-					
-					sys.exit(1)
+			return not waiting
+		
+		poll(all_ready, timeout=self.timeout)
+		
+		ready = [port for port in self.ports if not port in waiting]
+		if not ready:
+			log.error(
+				f'Unable to open gentle listener within {self.timeout:g} seconds. Halting execution. '
+				'For Windows users, is the docker service running?'
+			)
+			self._stop_instances()
+			sys.exit(1)
+		
+		if waiting:
+			log.warning(
+				f'gentle did not start on port(s) {", ".join(str(port) for port in waiting)} within {self.timeout:g} seconds. '
+				f'Continuing with {len(ready)} instance(s).'
+			)
+		
+		if self.metrics is not None:
+			self.metrics.record('gentle_startup', time.perf_counter() - start)
+			self.metrics.count('gentle_instances_started', len(ready))
+		
+		return GentlePool([f'http://localhost:{port}/transcriptions' for port in ready], metrics=self.metrics)
 	
 	def __exit__(self, exc_type, exc_value, tb):
 		if exc_type is not None:
 			traceback.print_exception(exc_type, exc_value, tb)
 		
-		log.info('Closing gentle listener')
-		'''Closes gentle and/or Docker correctly depending on OS.'''
+		if not self.launched:
+			return
+		
+		if self.keep_alive:
+			log.info(f'Leaving gentle running on port(s) {", ".join(str(port) for port in self.launched)}')
+			return
+		
+		log.info(f'Closing gentle listener{"s" if len(self.launched) > 1 else ""}')
+		self._stop_instances()
+	
+	def _stop_instances(self) -> None:
+		'''Closes the gentle instances started here and/or Docker correctly depending on OS.'''
 		if os.name == 'nt':
-			subprocess.call('powershell docker rm $(docker stop $(docker ps -a -q --filter ancestor=lowerquality/gentle))')
+			for port in self.launched:
+				subprocess.call(f'powershell docker rm $(docker stop $(docker ps -a -q --filter ancestor=lowerquality/gentle --filter publish={port}))')
+			
+			# Leave Docker alone if it was already running before we started
+			if not self.started_docker:
+				return
+			
 			time.sleep(5)
 			# We have to be an admin to properly shut everything down from the command prompt. 
 			# Otherwise, it has to be done from the tray menu.
@@ -173,8 +663,17 @@ class GentleListener():
 					'Docker service and VM cannot be terminated without admin '
 					'privileges. Make sure to manually exit Docker Desktop via the tray menu.'
 				)
-		else:
+		elif sys.platform == 'darwin':
 			subprocess.call("osascript -e 'quit app \"gentle\"'", shell=True)
+		else:
+			for process in self.processes:
+				process.terminate()
+			
+			for process in self.processes:
+				try:
+					process.wait(timeout=10)
+				except subprocess.TimeoutExpired:
+					process.kill()
 
 class TempDir():
 	'''Creates and closes a tmp dir.'''
@@ -192,6 +691,614 @@ class TempDir():
 		
 		shutil.rmtree(self.tmp_dir, ignore_errors=True)
 
+class AlignmentCache():
+	'''
+	Saves gentle's output on disk keyed by a hash of the audio, the transcription, and 
+	the gentle parameters, so unchanged items don't need to be aligned again.
+	The least recently used alignments are removed when the cache gets larger than max_size bytes.
+	Files are saved with the given extension, so the same cache can hold other things (like preconditioned audio).
+	If validate is provided, it is called on each entry that is read, and entries it raises a ValueError for 
+	(e.g., an error page saved by an older version) are removed and treated as missing.
+	'''
+	def __init__(
+		self, 
+		cache_dir: str, 
+		max_size: int = 1024 * 1024 * 1024, 
+		extension: str = 'json', 
+		validate: Callable[[bytes], Any] = None
+	):
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+		self.extension = extension
+		self.validate = validate
+		self.lock = threading.Lock()
+		os.makedirs(self.cache_dir, exist_ok=True)
+		self.size = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.name.endswith(f'.{self.extension}'))
+	
+	def key(self, audio_hash: str, transcript_hash: str, gentle_params: Dict) -> str:
+		'''Gets the cache key from the hashes of an audio file and its transcription, and the gentle parameters.'''
+		key = hashlib.sha256()
+		key.update(audio_hash.encode())
+		key.update(transcript_hash.encode())
+		key.update(json.dumps(gentle_params, sort_keys=True).encode())
+		return key.hexdigest()
+	
+	def get(self, key: str) -> Optional[bytes]:
+		'''Returns the cached alignment for key, or None if it is not in the cache.'''
+		path = os.path.join(self.cache_dir, f'{key}.{self.extension}')
+		try:
+			with open(path, 'rb') as in_file:
+				content = in_file.read()
+			
+			# mark this alignment as recently used
+			os.utime(path)
+		except FileNotFoundError:
+			return None
+		
+		if self.validate is not None:
+			try:
+				self.validate(content)
+			except ValueError as e:
+				log.warning(f'Removing an invalid entry from the cache ({e}).')
+				self.remove(key)
+				return None
+		
+		return content
+	
+	def remove(self, key: str) -> None:
+		'''Removes key from the cache, if it is there.'''
+		path = os.path.join(self.cache_dir, f'{key}.{self.extension}')
+		with self.lock:
+			try:
+				size = os.path.getsize(path)
+				os.remove(path)
+				self.size -= size
+			except FileNotFoundError:
+				pass
+	
+	def has(self, key: str) -> bool:
+		'''Checks whether key is in the cache, without marking it as recently used.'''
+		return os.path.isfile(os.path.join(self.cache_dir, f'{key}.{self.extension}'))
+	
+	def put(self, key: str, content: bytes) -> None:
+		'''Saves an alignment to the cache, removing the least recently used ones if it gets too big.'''
+		path = os.path.join(self.cache_dir, f'{key}.{self.extension}')
+		tmp_path = f'{path}.{threading.get_ident()}.tmp'
+		with open(tmp_path, 'wb') as out_file:
+			out_file.write(content)
+		
+		with self.lock:
+			if os.path.isfile(path):
+				self.size -= os.path.getsize(path)
+			
+			os.replace(tmp_path, path)
+			self.size += len(content)
+			if self.size > self.max_size:
+				self.evict()
+	
+	def evict(self) -> None:
+		'''Removes the least recently used alignments until the cache fits in max_size.'''
+		entries = sorted(
+			(entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(f'.{self.extension}')), 
+			key=lambda entry: entry.stat().st_mtime
+		)
+		for entry in entries:
+			if self.size <= self.max_size:
+				break
+			
+			try:
+				size = entry.stat().st_size
+				os.remove(entry.path)
+				self.size -= size
+			except FileNotFoundError:
+				pass
+
+class AlignmentManifest():
+	'''
+	Records the inputs and status of each item aligned from a sound directory, 
+	so that an interrupted or changed run can be resumed without aligning everything again.
+	The manifest is saved in the sound directory as align_manifest.json.
+	'''
+	def __init__(self, sound_dir: str, save_interval: float = 1.):
+		self.sound_dir = sound_dir
+		self.path = os.path.join(sound_dir, 'align_manifest.json')
+		self.save_interval = save_interval
+		self.last_save = 0.
+		self.lock = threading.Lock()
+		try:
+			with open(self.path, 'rt') as in_file:
+				self.data = json.load(in_file)
+		except (FileNotFoundError, json.JSONDecodeError):
+			self.data = {}
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, tb):
+		# save whatever we have, even if we crashed
+		self.save()
+	
+	def entry(self, transcription_file: str) -> Dict:
+		'''Gets the record for a transcription file, creating it if needed.'''
+		name = os.path.relpath(transcription_file, self.sound_dir)
+		with self.lock:
+			return self.data.setdefault(name, {'align_dir': None, 'items': {}})
+	
+	def update(self, transcription_file: str, json_name: str, **record) -> None:
+		'''Records the inputs and status of an item, saving the manifest at most once per save_interval seconds.'''
+		entry = self.entry(transcription_file)
+		with self.lock:
+			entry['items'][json_name] = record
+			if time.time() - self.last_save < self.save_interval:
+				return
+		
+		self.save()
+	
+	def save(self) -> None:
+		'''Writes the manifest to disk.'''
+		with self.lock:
+			tmp_path = f'{self.path}.tmp'
+			with open(tmp_path, 'wt') as out_file:
+				json.dump(self.data, out_file, indent=1)
+			
+			os.replace(tmp_path, self.path)
+			self.last_save = time.time()
+
+class DirectoryIndex():
+	'''
+	Lists a directory once with os.scandir, so that each step can look up its files without 
+	listing and sorting the directory again. The files with each extension are sorted once, each file's 
+	sort key (see sort_human) and item number are worked out once, and its stat info is kept once it 
+	has been looked up.
+	Call refresh() to list the directory again if files have been added to or removed from it.
+	'''
+	def __init__(self, directory: str):
+		self.directory = directory
+		self.refresh()
+	
+	def refresh(self) -> None:
+		'''Lists the directory and sorts the file names.'''
+		with os.scandir(self.directory) as entries:
+			self.entries = {entry.name: entry for entry in entries}
+		
+		self.keys = {}
+		self.items = {}
+		self.by_extension = {}
+	
+	def __len__(self) -> int:
+		return len(self.entries)
+	
+	def __contains__(self, name: str) -> bool:
+		return name in self.entries
+	
+	def files(self, extension: str) -> List[str]:
+		'''Gets the names of the files ending with extension, sorted in the same order as sort_human.'''
+		if not extension in self.by_extension:
+			names = [name for name in self.entries if name.endswith(extension)]
+			for name in names:
+				if not name in self.keys:
+					self.keys[name] = human_sort_key(name)
+			
+			self.by_extension[extension] = sorted(names, key=self.keys.__getitem__)
+		
+		return self.by_extension[extension]
+	
+	def item(self, name: str) -> str:
+		'''Gets the item number a file name starts with (see get_item_number).'''
+		if not name in self.items:
+			self.items[name] = get_item_number(name)
+		
+		return self.items[name]
+	
+	def path(self, name: str) -> str:
+		'''Gets the path to a file in the directory.'''
+		return self.entries[name].path
+	
+	def stat(self, name: str) -> os.stat_result:
+		'''Gets the stat info for a file in the directory, looking it up on disk only the first time.'''
+		return self.entries[name].stat()
+
+class Metrics():
+	'''
+	Records how long each stage of a run takes (once per item, for the stages that are done for each item),
+	and counts things like bytes uploaded, retries, and cache hits. Safe to use from several threads.
+	The summary can be saved as a JSON report and in Prometheus's text format.
+	'''
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.timings = {}
+		self.counters = {}
+		self.items = []
+		self.start = time.perf_counter()
+	
+	@contextmanager
+	def time(self, stage: str):
+		'''Records how long the code in the with block takes as one timing for stage.'''
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(stage, time.perf_counter() - start)
+	
+	def record(self, stage: str, seconds: float) -> None:
+		'''Records one timing for stage.'''
+		with self.lock:
+			self.timings.setdefault(stage, []).append(seconds)
+	
+	def count(self, counter: str, n: float = 1) -> None:
+		'''Adds n to counter.'''
+		with self.lock:
+			self.counters[counter] = self.counters.get(counter, 0) + n
+	
+	def item(self, transcription_file: str, item: str, seconds: float, status: str) -> None:
+		'''Records how long an item took from start to finish, and whether it was aligned.'''
+		with self.lock:
+			self.items.append({'transcription_file': transcription_file, 'item': item, 'seconds': seconds, 'status': status})
+		
+		self.record('item', seconds)
+	
+	def summary(self) -> Dict:
+		'''Gets the number of timings, total, median, 95th percentile, and maximum for each stage, and the counters.'''
+		with self.lock:
+			timings = {stage: sorted(seconds) for stage, seconds in self.timings.items()}
+			counters = dict(self.counters)
+			items = list(self.items)
+		
+		# nearest-rank percentiles
+		percentile = lambda seconds, q: seconds[max(0, math.ceil(q * len(seconds)) - 1)]
+		return {
+			'seconds': time.perf_counter() - self.start,
+			'stages': {
+				stage: {
+					'count': len(seconds),
+					'total': sum(seconds),
+					'p50': percentile(seconds, 0.5),
+					'p95': percentile(seconds, 0.95),
+					'max': seconds[-1],
+				}
+				for stage, seconds in timings.items()
+			},
+			'counters': counters,
+			'items': items,
+		}
+	
+	def save(self, path: str) -> Tuple[str,str]:
+		'''Saves the summary as JSON to path.json and in Prometheus's text format to path.prom. Returns the file names.'''
+		summary = self.summary()
+		with open(f'{path}.json', 'wt') as out_file:
+			json.dump(summary, out_file, indent=1)
+		
+		lines = [
+			'# HELP align_run_seconds How long align.py has been running.',
+			'# TYPE align_run_seconds gauge',
+			f'align_run_seconds {summary["seconds"]}',
+			'# HELP align_stage_seconds How long each stage took (per item, for the stages done for each item).',
+			'# TYPE align_stage_seconds summary',
+		]
+		for stage, stats in summary['stages'].items():
+			for quantile, name in [('0.5', 'p50'), ('0.95', 'p95'), ('1', 'max')]:
+				lines.append(f'align_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {stats[name]}')
+			
+			lines.append(f'align_stage_seconds_sum{{stage="{stage}"}} {stats["total"]}')
+			lines.append(f'align_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+		
+		for counter, value in summary['counters'].items():
+			lines.append(f'# TYPE align_{counter}_total counter')
+			lines.append(f'align_{counter}_total {value}')
+		
+		with open(f'{path}.prom', 'wt') as out_file:
+			out_file.write('\n'.join(lines) + '\n')
+		
+		return f'{path}.json', f'{path}.prom'
+
+class DurationTable():
+	'''
+	Collects rows of duration information in preallocated columns,
+	so that adding a row doesn't copy all the rows before it.
+	'''
+	def __init__(self, columns: List[str], size: int = 0):
+		self.columns = list(columns)
+		self.buffers = [[None] * size for _ in self.columns]
+		self.size = size
+		self.n_rows = 0
+	
+	def __len__(self) -> int:
+		return self.n_rows
+	
+	def append(self, row: Union[pd.Series, List]) -> None:
+		'''Adds a row to the table. Rows that are None (items gentle found no words in) are skipped.'''
+		if row is None:
+			return
+		
+		# grow by doubling if we get more rows than we allocated for
+		if self.n_rows == self.size:
+			grow = max(self.size, 1)
+			for buffer in self.buffers:
+				buffer.extend([None] * grow)
+			
+			self.size += grow
+		
+		for buffer, value in zip(self.buffers, list(row)):
+			buffer[self.n_rows] = value
+		
+		self.n_rows += 1
+	
+	def to_frame(self) -> pd.DataFrame:
+		'''Returns the rows added so far as a data frame.'''
+		return pd.DataFrame(
+			{column: pd.Series(buffer[:self.n_rows], dtype=object) for column, buffer in zip(self.columns, self.buffers)},
+			columns=self.columns
+		)
+
+class WordTimingTable():
+	'''
+	Collects timing information in long format (one row per word) in columns, 
+	and saves it to a typed, compressed Parquet or Feather (Arrow) file.
+	'''
+	def __init__(self):
+		self.columns = {
+			'file': [],
+			'item': [],
+			'word_index': [],
+			'word': [],
+			'onset': [],
+			'offset': [],
+			'duration': [],
+		}
+	
+	def __len__(self) -> int:
+		return len(self.columns['word'])
+	
+	def append(self, file: str, item: str, timings: List[Tuple[str, float, float, float]]) -> None:
+		'''Adds the timings for an item, as returned by get_word_timings. None is skipped.'''
+		if timings is None:
+			return
+		
+		for word_index, (word, onset, offset, duration) in enumerate(timings):
+			self.columns['file'].append(file)
+			self.columns['item'].append(item)
+			self.columns['word_index'].append(word_index)
+			self.columns['word'].append(word)
+			self.columns['onset'].append(onset)
+			self.columns['offset'].append(offset)
+			self.columns['duration'].append(duration)
+	
+	def to_arrow(self) -> 'pa.Table':
+		'''Returns the timings as an Arrow table with typed columns.'''
+		items = self.columns['item']
+		try:
+			items = pa.array([int(item) for item in items], pa.int64())
+		except ValueError:
+			items = pa.array(items, pa.string())
+		
+		return pa.table({
+			'file': pa.array(self.columns['file'], pa.string()).dictionary_encode(),
+			'item': items,
+			'word_index': pa.array(self.columns['word_index'], pa.int32()),
+			'word': pa.array(self.columns['word'], pa.string()).dictionary_encode(),
+			'onset': pa.array(self.columns['onset'], pa.float64()),
+			'offset': pa.array(self.columns['offset'], pa.float64()),
+			'duration': pa.array(self.columns['duration'], pa.float64()),
+		})
+	
+	def save(self, output_dir: str, output_format: str = 'parquet') -> str:
+		'''
+		Saves the timings to durations.parquet or durations.feather in output_dir,
+		without overwriting output from a previous transcription file.
+		Returns the name of the file.
+		'''
+		counter = 0
+		out_file = os.path.join(output_dir, f'durations.{output_format}')
+		while os.path.isfile(out_file):
+			counter += 1
+			out_file = os.path.join(output_dir, f'durations{counter}.{output_format}')
+		
+		table = self.to_arrow()
+		if output_format == 'parquet':
+			pq.write_table(table, out_file, compression='zstd')
+		else:
+			feather.write_feather(table, out_file, compression='zstd')
+		
+		return out_file
+
+# the cases gentle reports for each word, in the order they are numbered in a WordStore
+GENTLE_CASES = ['success', 'not-found-in-audio', 'not-found-in-transcript']
+
+class WordStore():
+	'''
+	Collects gentle's alignments for many items in columns, and saves them as NumPy arrays
+	that can be memory-mapped with MappedWordStore. For each word, this is the item it is in, 
+	its position in the item, the ids of the word and of the word gentle aligned it to (-1 if 
+	it wasn't aligned) in a shared vocabulary, its start and end in seconds (NaN if it wasn't 
+	aligned), its position in the transcript (-1 if it has none), and its case (the index in GENTLE_CASES, 
+	or -1 if it has none). 
+	The words of each item are stored together, and where they begin is stored in an offsets table.
+	'''
+	COLUMNS = {
+		'item_id': np.int32,
+		'word_index': np.int32,
+		'word_id': np.int32,
+		'aligned_id': np.int32,
+		'start': np.float64,
+		'end': np.float64,
+		'start_offset': np.int32,
+		'end_offset': np.int32,
+		'case': np.int8,
+	}
+	
+	def __init__(self):
+		self.items = []
+		self.vocabulary = {}
+		self.columns = {column: [] for column in self.COLUMNS}
+		self.lock = threading.Lock()
+	
+	def __len__(self) -> int:
+		return len(self.items)
+	
+	def intern(self, word: str) -> int:
+		'''Gets the id of word in the vocabulary, adding it if it's new.'''
+		return self.vocabulary.setdefault(word, len(self.vocabulary))
+	
+	def append(self, item: str, alignment: Dict) -> None:
+		'''Adds gentle's alignment for an item. Safe to call from several threads.'''
+		with self.lock:
+			item_id = len(self.items)
+			self.items.append(item)
+			for word_index, word in enumerate(alignment.get('words', [])):
+				self.columns['item_id'].append(item_id)
+				self.columns['word_index'].append(word_index)
+				self.columns['word_id'].append(self.intern(word.get('word', '')))
+				self.columns['aligned_id'].append(self.intern(word['alignedWord']) if 'alignedWord' in word else -1)
+				self.columns['start'].append(word.get('start', np.nan))
+				self.columns['end'].append(word.get('end', np.nan))
+				self.columns['start_offset'].append(word.get('startOffset', -1))
+				self.columns['end_offset'].append(word.get('endOffset', -1))
+				self.columns['case'].append(GENTLE_CASES.index(word.get('case')) if word.get('case') in GENTLE_CASES else -1)
+	
+	def save(self, directory: str) -> str:
+		'''
+		Saves the items (sorted by name), the offsets table, the vocabulary, and each column 
+		as .npy files in directory, replacing what is there. Returns the directory.
+		'''
+		with self.lock:
+			counts = np.bincount(np.array(self.columns['item_id'], dtype=np.int64), minlength=len(self.items))
+			starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+			order = sorted(range(len(self.items)), key=lambda item_id: human_sort_key(self.items[item_id]))
+			rows = (
+				np.concatenate([np.arange(starts[item_id], starts[item_id] + counts[item_id]) for item_id in order]) 
+				if order else np.array([], dtype=np.int64)
+			)
+			
+			arrays = {
+				'items': np.array([self.items[item_id] for item_id in order], dtype=str),
+				'offsets': np.concatenate([[0], np.cumsum(counts[order])]).astype(np.int64),
+				'vocabulary': np.array(list(self.vocabulary), dtype=str),
+			}
+			for column, dtype in self.COLUMNS.items():
+				arrays[column] = np.array(self.columns[column], dtype=dtype)[rows]
+			
+			# number the items in the order they are saved
+			arrays['item_id'] = np.argsort(order).astype(np.int32)[arrays['item_id']]
+		
+		# write everything before replacing the old store, so it's never left half written
+		tmp_dir = f'{directory}.tmp'
+		os.makedirs(tmp_dir, exist_ok=True)
+		for name, array in arrays.items():
+			np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+		
+		if os.path.isdir(directory):
+			shutil.rmtree(directory)
+		
+		os.replace(tmp_dir, directory)
+		return directory
+
+class MappedWordStore():
+	'''
+	Opens a store saved by WordStore with its columns memory-mapped, so only the parts that are used are read 
+	from disk (the items and vocabulary, which are small, are read in full). Use store[item] to get an item's columns as arrays, or store.words(item) to get its words in 
+	gentle's format. The columns for every word of every item are also available as attributes (e.g., store.start).
+	'''
+	def __init__(self, directory: str):
+		self.directory = directory
+		self.items = np.load(os.path.join(directory, 'items.npy')).tolist()
+		self.index = {item: item_id for item_id, item in enumerate(self.items)}
+		self.offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r')
+		self.vocabulary = np.load(os.path.join(directory, 'vocabulary.npy')).tolist()
+		for column in WordStore.COLUMNS:
+			# plain arrays over the mapped memory are much faster to slice than np.memmap
+			setattr(self, column, np.asarray(np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')))
+	
+	def __len__(self) -> int:
+		return len(self.items)
+	
+	def __contains__(self, item: str) -> bool:
+		return item in self.index
+	
+	def __getitem__(self, item: str) -> Dict[str, np.ndarray]:
+		'''Gets each column for the words of item. These are views of the memory-mapped arrays.'''
+		item_id = self.index[item]
+		first, last = self.offsets[item_id], self.offsets[item_id + 1]
+		return {column: getattr(self, column)[first:last] for column in WordStore.COLUMNS}
+	
+	def words(self, item: str) -> List[Dict]:
+		'''Gets the words of item in the same format as gentle's alignments, but without their phones.'''
+		columns = {column: values.tolist() for column, values in self[item].items()}
+		words = []
+		for i in range(len(columns['word_id'])):
+			word = {'word': self.vocabulary[columns['word_id'][i]]}
+			
+			# leave out what gentle didn't give for this word
+			if columns['case'][i] >= 0:
+				word['case'] = GENTLE_CASES[columns['case'][i]]
+			
+			if columns['start_offset'][i] >= 0:
+				word['startOffset'] = columns['start_offset'][i]
+			
+			if columns['end_offset'][i] >= 0:
+				word['endOffset'] = columns['end_offset'][i]
+			
+			if columns['aligned_id'][i] >= 0:
+				word.update({
+					'alignedWord': self.vocabulary[columns['aligned_id'][i]],
+					'start': columns['start'][i],
+					'end': columns['end'][i],
+				})
+			
+			words.append(word)
+		
+		return words
+	
+	def timings(self, item: str) -> List[Tuple[str, float, float, float]]:
+		'''Gets the timings of the aligned words of item, as get_word_timings does.'''
+		return get_word_timings([word for word in self.words(item) if 'alignedWord' in word])
+
+def open_word_store(align_dir: str) -> Optional[MappedWordStore]:
+	'''Opens the word store saved in align_dir by save_alignments, if there is one.'''
+	directory = os.path.join(align_dir, 'words')
+	if not os.path.isfile(os.path.join(directory, 'offsets.npy')):
+		return None
+	
+	return MappedWordStore(directory)
+
+def poll(
+	condition: Callable[[], bool], 
+	timeout: float, 
+	initial_delay: float = 0.1, 
+	max_delay: float = 5, 
+	backoff: float = 1.5
+) -> bool:
+	'''
+	Checks condition until it is true or timeout seconds have passed, 
+	waiting a little longer between each check.
+	Returns whether the condition was met.
+	'''
+	deadline = time.monotonic() + timeout
+	delay = initial_delay
+	while True:
+		if condition():
+			return True
+		
+		remaining = deadline - time.monotonic()
+		if remaining <= 0:
+			return False
+		
+		time.sleep(min(delay, remaining))
+		delay = min(delay * backoff, max_delay)
+
+def is_gentle_ready(port: int) -> bool:
+	'''Checks whether gentle is answering on a port.'''
+	try:
+		return requests.get(f'http://localhost:{port}', timeout=2).ok
+	except requests.exceptions.RequestException:
+		return False
+
+def is_docker_ready() -> bool:
+	'''Checks whether the Docker engine is running and answering commands.'''
+	try:
+		return subprocess.call('docker info', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+	except OSError:
+		return False
+
 def is_admin() -> bool:
 	'''
 	Checks if the current user is an admin on Windows.
@@ -212,27 +1319,43 @@ def sort_human(l: List[str]) -> List[str]:
 		returns:
 			the list of file names, sorted in a human-like way
 	'''
+	return sorted(l, key=human_sort_key)
+
+def human_sort_key(name: str) -> List[Union[str, float]]:
+	'''Gets the key that sort_human sorts a file name by.'''
 	convert = lambda text: float(text) if text.isdigit() else text
-	alphanum = lambda key: [convert(c) for c in re.split(r'([-+]?[0-9]*)\.?([0-9]*)', key)]
-	return sorted(l, key=alphanum)
+	return [convert(c) for c in re.split(r'([-+]?[0-9]*)\.?([0-9]*)', name)]
+
+def get_item_number(name: str) -> str:
+	'''Gets the item number a file name (or item) starts with, without leading zeros.'''
+	return re.findall('^[0-9]*', name)[0].lstrip('0')
 
 def sort_flatten(l: List) -> List:
 	'''Flattens a nested list of lists.'''
 	return sort_human([item for sublist in l for item in sublist])
 
-def parse_arguments() -> 'argparse.NameSpace':
-	'''Parses and verifies command line arguments.'''
+def parse_arguments(argv: List[str] = None) -> 'argparse.NameSpace':
+	'''Parses and verifies command line arguments (or argv, if provided).'''
 	# Read in the arguments
-	args = parser.parse_args()
+	args = parser.parse_args(argv)
 	
 	# Can't set the port on a Mac
-	if os.name != 'nt' and args.port != 8765:
+	if sys.platform == 'darwin' and args.port != 8765:
 		log.info('Cannot change default port for gentle on Mac. Setting port to 8765.')
-		args.port = '8765'
+		args.port = 8765
+	
+	# Can't run more than one standalone gentle on a Mac
+	if sys.platform == 'darwin' and args.instances != 1:
+		log.info('Cannot run more than one gentle instance on Mac. Setting instances to 1.')
+		args.instances = 1
+	
+	if args.instances < 1:
+		log.error(f'--instances must be at least 1 (got {args.instances}).')
+		sys.exit(1)
 	
 	# No use for docker location argument on Mac
 	if os.name != 'nt' and args.docker_location != '"%ProgramFiles%/Docker/Docker/Docker Desktop.exe"':
-		log.info('--docker_location is not used on Mac.')
+		log.info('--docker_location is not used on Mac or Linux.')
 	
 	# Add the exe extension to docker location if needed
 	if os.name == 'nt' and (
@@ -293,8 +1416,13 @@ def parse_arguments() -> 'argparse.NameSpace':
 		sys.exit(1)
 	
 	# Check that the sound_dirs exist and have audio files in them
+	# Each is listed once here, and the listing is reused for the rest of the run
+	args.sound_dir_indexes = {}
 	for sound_dir in args.sound_dirs:
-		if not os.path.exists(sound_dir) or len([file for file in os.listdir(sound_dir) if file.endswith('.mp3')]) == 0:
+		if os.path.isdir(sound_dir):
+			args.sound_dir_indexes[sound_dir] = DirectoryIndex(sound_dir)
+		
+		if not sound_dir in args.sound_dir_indexes or not args.sound_dir_indexes[sound_dir].files('.mp3'):
 			log.error(
 				f'Error: directory {sound_dir!r} not found, '
 				f'or it does not contain mp3 files.'
@@ -342,127 +1470,1054 @@ def parse_arguments() -> 'argparse.NameSpace':
 			log.error(f'File {stimuli_file!r} not found.')	
 			sys.exit(1)
 	
-	if not os.name == 'nt' and not args.wait == 75:
-		log.info('--wait argument is not used on Mac.')
+	if not os.name == 'nt' and not args.wait == 75:
+		log.info('--wait argument is not used on Mac or Linux.')
+	
+	if args.precondition and shutil.which('ffmpeg') is None:
+		log.error('ffmpeg is required to precondition audio. Install it and make sure it is on your PATH.')
+		sys.exit(1)
+	
+	if args.split < 0:
+		log.error(f'--split must not be negative (got {args.split}).')
+		sys.exit(1)
+	
+	if args.split and args.split_silence <= 0:
+		log.error(f'--split_silence must be greater than 0 (got {args.split_silence}).')
+		sys.exit(1)
+	
+	if args.split and shutil.which('ffmpeg') is None:
+		log.error('ffmpeg is required to split recordings. Install it and make sure it is on your PATH.')
+		sys.exit(1)
+	
+	if args.output_format != 'csv' and pa is None:
+		log.error(f'pyarrow is required to save durations as {args.output_format}. Install it with `pip install pyarrow`.')
+		sys.exit(1)
+	
+	if args.cache_size < 0:
+		log.error(f'--cache_size must not be negative (got {args.cache_size}).')
+		sys.exit(1)
+	
+	if args.extract_jobs < 1:
+		log.error(f'--extract_jobs must be at least 1 (got {args.extract_jobs}).')
+		sys.exit(1)
+	
+	if args.jobs < 1:
+		log.error(f'--jobs must be at least 1 (got {args.jobs}).')
+		sys.exit(1)
+	
+	if args.timeout <= 0:
+		log.error(f'--timeout must be greater than 0 (got {args.timeout}).')
+		sys.exit(1)
+	
+	if args.timeout_factor < 0:
+		log.error(f'--timeout_factor must not be negative (got {args.timeout_factor}).')
+		sys.exit(1)
+	
+	if args.retries < 0:
+		log.error(f'--retries must not be negative (got {args.retries}).')
+		sys.exit(1)
+	
+	return args
+
+def make_new_dir(prefix: str = '', suffix: str = 'tmp') -> str:
+	'''Make a directory that won't overwrite an existing directory.'''
+	tmp_dir = f'{prefix}{suffix}'
+	counter = 1
+	while os.path.exists(tmp_dir):
+		tmp_dir = f'{prefix}{suffix}{counter}'
+		counter += 1
+	
+	os.makedirs(tmp_dir)
+	
+	return tmp_dir
+
+def get_transcriptions(
+	transcription_file: str, 
+	item_col: str, 
+	transcription_col: str
+) -> Dict[str,bytes]:
+	'''
+	Reads the transcriptions in a csv and prepares them to send to gentle.
+	Returns a dict mapping item numbers to the encoded transcriptions, sorted by item.
+	'''
+	transcription_data = pd.read_csv(transcription_file)
+	transcription_data = transcription_data.sort_values(by=[item_col], ascending=True)
+	
+	transcriptions = dict(zip(transcription_data[item_col], transcription_data[transcription_col]))
+	return {
+		str(item): re.sub(u'\u201d', "'", transcription).encode('utf-8') 
+		for item, transcription in transcriptions.items()
+	}
+
+def save_transcriptions_to_text(
+	transcription_file: str, 
+	item_col: str, 
+	transcription_col: str, 
+	output_dir: str
+) -> None:
+	'''Saves transcriptions in a csv to text files to send to gentle.'''
+	transcriptions = get_transcriptions(
+		transcription_file=transcription_file, 
+		item_col=item_col, 
+		transcription_col=transcription_col
+	)
+	
+	# For each row, save the transcription for that row in a file with the name being the item number
+	for item, transcription in transcriptions.items():
+		with open(os.path.join(output_dir, f'{item}.txt'), 'wb') as file:
+			file.write(transcription)
+
+def get_mp3_to_text_mapping(
+	sound_dir: str, 
+	text_dir: str, 
+	transcription_file: str = '',
+	sound_index: DirectoryIndex = None
+) -> Dict[str,str]:
+	'''
+	Gets the mapping between mp3 audio files and text files to send to gentle.
+	If a sound_index is provided, it is used instead of listing sound_dir again.
+	'''
+	# Read in and sort the audio file names and text file names
+	sound_index = sound_index if sound_index is not None else DirectoryIndex(sound_dir)
+	text_index  = DirectoryIndex(text_dir)
+	audio_names = sound_index.files('.mp3')
+	text_names  = text_index.files('.txt')
+	
+	if len(audio_names) != len(text_names):
+		raise ValueError(
+			f'Number of audio files ({len(audio_names)}) and '
+			f'number of transcriptions ({len(text_names)}) do not match for '
+			f'directory {sound_dir!r} and transcription file {transcription_file!r}.'
+		)
+	
+	# Check that audio files begin with the item numbers from the transcription file
+	audio_num = [sound_index.item(audio_name) for audio_name in audio_names]
+	text_num  = [text_index.item(text_name) for text_name in text_names]
+	if audio_num != text_num:
+		raise ValueError(f'Audio file numbers do not match item numbers in transcription file {transcription_file!r}.')
+	
+	audio_text = dict(zip(audio_names, text_names))
+	
+	return audio_text
+
+def get_mp3_to_transcript_mapping(
+	sound_dir: str, 
+	transcriptions: Dict[str,bytes], 
+	transcription_file: str = '',
+	sound_index: DirectoryIndex = None
+) -> Dict[str,str]:
+	'''
+	Gets the mapping between mp3 audio files and in-memory transcriptions (from get_transcriptions) to send to gentle.
+	Audio files are matched to transcriptions by item number, ignoring leading zeros.
+	If a sound_index is provided, it is used instead of listing sound_dir again.
+	'''
+	sound_index = sound_index if sound_index is not None else DirectoryIndex(sound_dir)
+	audio_names = sound_index.files('.mp3')
+	
+	if len(audio_names) != len(transcriptions):
+		raise ValueError(
+			f'Number of audio files ({len(audio_names)}) and '
+			f'number of transcriptions ({len(transcriptions)}) do not match for '
+			f'directory {sound_dir!r} and transcription file {transcription_file!r}.'
+		)
+	
+	# Check that audio files begin with the item numbers from the transcription file
+	items = {get_item_number(item): item for item in transcriptions}
+	audio_items = {}
+	for audio_name in audio_names:
+		audio_num = sound_index.item(audio_name)
+		if not audio_num in items:
+			raise ValueError(f'Audio file numbers do not match item numbers in transcription file {transcription_file!r}.')
+		
+		audio_items[audio_name] = items[audio_num]
+	
+	if len(set(audio_items.values())) != len(transcriptions):
+		raise ValueError(f'Audio file numbers do not match item numbers in transcription file {transcription_file!r}.')
+	
+	return audio_items
+
+def precondition_audio(
+	audio: bytes, 
+	audio_cache: AlignmentCache, 
+	sample_rate: int = 8000, 
+	bitrate: str = '32k'
+) -> bytes:
+	'''
+	Converts audio to a compact mono mp3 at sample_rate to send to gentle, 
+	which resamples to 8 kHz mono anyway. Converted audio is cached by the hash of the original.
+	If the audio can't be converted, the original is returned.
+	'''
+	key = hashlib.sha256(audio + f'{sample_rate}:{bitrate}'.encode()).hexdigest()
+	content = audio_cache.get(key)
+	if content is not None:
+		return content
+	
+	try:
+		content = subprocess.run(
+			['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', '-ac', '1', '-ar', str(sample_rate), '-b:a', bitrate, '-f', 'mp3', 'pipe:1'],
+			input=audio, capture_output=True, check=True
+		).stdout
+	except subprocess.CalledProcessError as e:
+		log.warning(f'Unable to precondition audio ({e.stderr.decode(errors="replace").strip()}). Sending the original.')
+		return audio
+	
+	audio_cache.put(key, content)
+	return content
+
+# bitrates in kbps for each bitrate index, and sample rates in Hz for each sample rate index, 
+# in MPEG-1 and MPEG-2/2.5 layer III frame headers
+MP3_BITRATES = {
+	1: [None, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, None],
+	2: [None, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, None],
+}
+MP3_SAMPLE_RATES = {
+	3: [44100, 48000, 32000],
+	2: [22050, 24000, 16000],
+	0: [11025, 12000, 8000],
+}
+
+def get_audio_seconds(audio: bytes, default_kbps: int = 128) -> float:
+	'''
+	Estimates how long an mp3 is from its size and the bitrate in its first frame header, without decoding it.
+	This is exact for constant bitrate mp3s and close for others. If there is no frame header where
+	one is expected, default_kbps is assumed.
+	'''
+	# skip an ID3v2 tag
+	start = 0
+	if audio[:3] == b'ID3' and len(audio) >= 10:
+		start = 10 + (audio[6] << 21 | audio[7] << 14 | audio[8] << 7 | audio[9])
+	
+	kbps = default_kbps
+	for _ in range(2):
+		header = audio[start:start + 4]
+		if not (len(header) == 4 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0 and (header[1] >> 1) & 0x3 == 1):
+			break
+		
+		version = (header[1] >> 3) & 0x3
+		bitrate = MP3_BITRATES[1 if version == 3 else 2][header[2] >> 4]
+		if version == 1 or bitrate is None or (header[2] >> 2) & 0x3 == 3:
+			break
+		
+		kbps = bitrate
+		
+		# the first frame can be a Xing or LAME header with its own bitrate, in which case the next frame is used
+		sample_rate = MP3_SAMPLE_RATES[version][(header[2] >> 2) & 0x3]
+		length = (144 if version == 3 else 72) * bitrate * 1000 // sample_rate + ((header[2] >> 1) & 0x1)
+		if not any(tag in audio[start:start + min(length, 64)] for tag in (b'Xing', b'Info')):
+			break
+		
+		start += length
+	
+	return max(0, len(audio) - start) * 8 / (kbps * 1000)
+
+def get_deadline(audio: bytes, timeout: float = 60, timeout_factor: float = 5) -> float:
+	'''Gets how long to wait for gentle to align audio: timeout seconds, plus timeout_factor seconds per second of audio.'''
+	return timeout + timeout_factor * get_audio_seconds(audio)
+
+def post_alignment(
+	session: requests.Session,
+	gentle_pool: GentlePool,
+	gentle_params: Dict,
+	audio_file: str,
+	audio: bytes,
+	text_file: str,
+	transcript: bytes,
+	timeout: float = None,
+	retries: int = 0,
+	hedge: bool = False
+) -> requests.Response:
+	'''
+	Sends one audio file and its transcription to gentle and returns the response.
+	Waits up to timeout seconds for gentle to respond, trying again up to retries times, and 
+	hedges slow requests if hedge is set (see GentlePool.post).
+	'''
+	files = {
+		'audio': (audio_file, audio, 'audio/mpeg'), 
+		'transcript': (text_file, transcript, 'text/plain')
+	}
+	
+	# this gets the alignment data from gentle
+	return gentle_pool.post(session, hedge=hedge, retries=retries, params=gentle_params, files=files, timeout=timeout)
+
+def submit_alignment(
+	session: requests.Session,
+	gentle_pool: GentlePool,
+	gentle_params: Dict,
+	audio_file: str,
+	audio: bytes,
+	text_file: str,
+	transcript: bytes,
+	timeout: float = None,
+	retries: int = 0
+) -> Tuple[str, requests.Response]:
+	'''
+	Submits one audio file and its transcription to gentle's asynchronous API without following the redirect to the job.
+	Returns the instance it was sent to, which stays reserved in gentle_pool until released, and the response.
+	Waits up to timeout seconds for gentle to respond, trying again up to retries times.
+	'''
+	files = {
+		'audio': (audio_file, audio, 'audio/mpeg'), 
+		'transcript': (text_file, transcript, 'text/plain')
+	}
+	
+	return gentle_pool.submit(
+		session, retries=retries, params=gentle_params, files=files, allow_redirects=False, timeout=timeout
+	)
+
+def find_pauses(
+	audio: bytes, 
+	min_silence: float = 0.5, 
+	noise: str = '-35dB', 
+	sample_rate: int = 8000
+) -> Tuple[bytes, List[Tuple[float,float]]]:
+	'''
+	Decodes audio to 16-bit mono PCM at sample_rate with ffmpeg, and finds the pauses in it 
+	(where it is quieter than noise for at least min_silence seconds) at the same time.
+	Returns the PCM, and the start and end of each pause in seconds.
+	'''
+	decoded = subprocess.run(
+		[
+			'ffmpeg', '-hide_banner', '-nostats', '-i', 'pipe:0', '-af', f'silencedetect=noise={noise}:d={min_silence}', 
+			'-ac', '1', '-ar', str(sample_rate), '-f', 's16le', 'pipe:1'
+		],
+		input=audio, capture_output=True, check=True
+	)
+	messages = decoded.stderr.decode(errors='replace')
+	starts = [float(start) for start in re.findall(r'silence_start: (\S+)', messages)]
+	ends = [float(end) for end in re.findall(r'silence_end: (\S+)', messages)]
+	
+	# a pause at the end of the audio doesn't have an end
+	ends += [len(decoded.stdout) / 2 / sample_rate] * (len(starts) - len(ends))
+	return decoded.stdout, [(max(0., start), end) for start, end in zip(starts, ends)]
+
+def get_segments(duration: float, pauses: List[Tuple[float,float]], max_seconds: float) -> List[Tuple[float,float]]:
+	'''
+	Splits duration seconds of audio into segments no longer than max_seconds where possible, cutting in the 
+	middle of pauses. Each segment ends at the last pause that keeps it short enough, or, if there isn't one, the next pause.
+	Returns the start and end of each segment in seconds.
+	'''
+	cuts = [(start + end) / 2 for start, end in pauses if 0 < start and end < duration]
+	segments = []
+	start = 0.
+	while duration - start > max_seconds:
+		shorter = [cut for cut in cuts if start < cut <= start + max_seconds]
+		longer = [cut for cut in cuts if cut > start + max_seconds]
+		if not shorter and not longer:
+			break
+		
+		cut = max(shorter) if shorter else min(longer)
+		segments.append((start, cut))
+		start = cut
 	
-	return args
+	segments.append((start, duration))
+	return segments
 
-def make_new_dir(prefix: str = '', suffix: str = 'tmp') -> str:
-	'''Make a directory that won't overwrite an existing directory.'''
-	tmp_dir = f'{prefix}{suffix}'
-	counter = 1
-	while os.path.exists(tmp_dir):
-		tmp_dir = f'{prefix}{suffix}{counter}'
-		counter += 1
+def plan_segments(
+	transcript: str, 
+	duration: float, 
+	pauses: List[Tuple[float,float]], 
+	max_seconds: float, 
+	window: float = 0.25
+) -> List[Tuple[float,float,int,int]]:
+	'''
+	Splits audio into segments with get_segments, and splits transcript to match. Assuming that speech is spread 
+	evenly over the parts of the audio that aren't pauses, each cut in the audio is matched to a position in the 
+	transcript, which is then moved to the nearest space. Spaces after punctuation within window (as a proportion of 
+	the average segment's length) are preferred. Segments without any words in them are joined to the next one.
+	Returns the start and end (in seconds) and the first and last character of each segment.
+	'''
+	def speech_before(t: float) -> float:
+		return t - sum(max(0., min(end, t) - start) for start, end in pauses if start < t)
 	
-	os.makedirs(tmp_dir)
+	segments = get_segments(duration=duration, pauses=pauses, max_seconds=max_seconds)
+	speech = speech_before(duration) or duration
+	spaces = [match.start() for match in re.finditer(r'\s+', transcript)]
+	after_punctuation = [space for space in spaces if space > 0 and transcript[space - 1] in '.,;:!?']
+	spread = window * len(transcript) / len(segments)
 	
-	return tmp_dir
+	positions = [0]
+	for _, cut in segments[:-1]:
+		target = len(transcript) * speech_before(cut) / speech
+		options = (
+			[space for space in after_punctuation if space > positions[-1] and abs(space - target) <= spread] or
+			[space for space in spaces if space > positions[-1]]
+		)
+		positions.append(min(options, key=lambda space: abs(space - target)) if options else len(transcript))
+	
+	positions.append(len(transcript))
+	
+	planned = []
+	joined = None
+	for (start, end), first, last in zip(segments, positions, positions[1:]):
+		if joined is not None:
+			start, first = joined
+			joined = None
+		
+		if not re.search(r'\w', transcript[first:last]):
+			joined = (start, first)
+			continue
+		
+		planned.append((start, end, first, last))
+	
+	# words can't be left over at the end, since the last segment goes to the end of the transcript
+	if joined is not None and planned:
+		start, _, first, _ = planned.pop()
+		planned.append((start, duration, first, len(transcript)))
+	
+	return planned
 
-def save_transcriptions_to_text(
-	transcription_file: str, 
-	item_col: str, 
-	transcription_col: str, 
-	output_dir: str
-) -> None:
-	'''Saves transcriptions in a csv to text files to send to gentle.'''
-	# write the transcriptions out in text files
-	transcription_data = pd.read_csv(transcription_file)
-	transcription_data = transcription_data.sort_values(by=[item_col], ascending=True)
+def stitch_alignments(transcript: str, alignments: List[Dict], offsets: List[Tuple[float,int]]) -> Dict:
+	'''
+	Puts the alignments of segments of a recording back together into one alignment of the whole thing 
+	for transcript, in the same format as gentle's. offsets has the start of each segment in seconds and
+	the position of its transcript in transcript.
+	'''
+	words = []
+	for alignment, (seconds, characters) in zip(alignments, offsets):
+		for word in alignment['words']:
+			word = dict(word)
+			for key in ['start', 'end']:
+				if key in word:
+					word[key] = round(word[key] + seconds, 6)
+			
+			for key in ['startOffset', 'endOffset']:
+				if key in word:
+					word[key] += characters
+			
+			words.append(word)
 	
-	# For each row, save the transcription for that row in a file with the name being the item number
-	transcriptions = dict(zip(transcription_data[item_col], transcription_data[transcription_col]))
-	for item, transcription in transcriptions.items():
-		with open(os.path.join(output_dir, f'{item}.txt'), 'wt') as file:
-			file.write(re.sub(u'\u201d', "'", transcription))
+	return {'transcript': transcript, 'words': words}
 
-def get_mp3_to_text_mapping(
-	sound_dir: str, 
-	text_dir: str, 
-	transcription_file: str = ''
-) -> Dict[str,str]:
-	'''Gets the mapping between mp3 audio files and text files to send to gentle.'''
-	# Read in and sort the audio file names and text file names
-	audio_names = sort_human([file for file in os.listdir(sound_dir) if file.endswith('.mp3')])
-	text_names  = sort_human([file for file in os.listdir(text_dir) if file.endswith('.txt')])
+def post_alignment_in_segments(
+	session: requests.Session,
+	gentle_pool: GentlePool,
+	gentle_params: Dict,
+	audio_file: str,
+	audio: bytes,
+	text_file: str,
+	transcript: bytes,
+	max_seconds: float,
+	min_silence: float = 0.5,
+	jobs: int = 1,
+	timeout: float = None,
+	timeout_factor: float = 0,
+	retries: int = 0,
+	hedge: bool = False,
+	sample_rate: int = 8000,
+	executor: ThreadPoolExecutor = None
+) -> Tuple[Optional[bytes], Optional[requests.Response]]:
+	'''
+	Aligns a long recording by splitting it and its transcription into segments at pauses (see plan_segments), 
+	and sending the segments to gentle, up to jobs at once. If an executor is provided, the segments are sent 
+	with it instead, so that it can limit how many are sent at once across several recordings. 
+	The segments are sent as wav files at sample_rate, since gentle resamples to 8 kHz mono anyway. 
+	Their alignments are put back together with stitch_alignments.
+	If the audio can't be split, it is sent whole. timeout, timeout_factor, retries, and hedge are used as by save_alignments.
+	Returns the alignment as JSON, or, if gentle couldn't align part of the recording, None and gentle's response for that part.
+	Raises a ValueError if gentle answers part of the recording with something that isn't an alignment.
+	'''
+	text = transcript.decode('utf-8')
+	try:
+		pcm, pauses = find_pauses(audio, min_silence=min_silence, sample_rate=sample_rate)
+		segments = plan_segments(text, duration=len(pcm) / 2 / sample_rate, pauses=pauses, max_seconds=max_seconds)
+	except subprocess.CalledProcessError as e:
+		log.warning(f'Unable to find pauses in {audio_file!r} ({e.stderr.decode(errors="replace").strip()[-200:]}). Sending it whole.')
+		segments = []
 	
-	if len(audio_names) != len(text_names):
-		raise ValueError(
-			f'Number of audio files ({len(audio_names)}) and '
-			f'number of transcriptions ({len(text_names)}) do not match for '
-			f'directory {sound_dir!r} and transcription file {transcription_file!r}.'
+	kwargs = dict(session=session, gentle_pool=gentle_pool, gentle_params=gentle_params, retries=retries, hedge=hedge)
+	if len(segments) < 2:
+		r = post_alignment(
+			**kwargs, 
+			audio_file=audio_file, 
+			audio=audio, 
+			text_file=text_file, 
+			transcript=transcript, 
+			timeout=get_deadline(audio, timeout=timeout, timeout_factor=timeout_factor) if timeout is not None else None
 		)
+		return (r.content, None) if r.ok else (None, r)
 	
-	# Check that audio files begin with the item numbers from the transcription file
-	audio_num = [re.findall('^[0-9]*', audio_name)[0].lstrip('0') for audio_name in audio_names]
-	text_num  = [re.findall('^[0-9]*', text_name)[0].lstrip('0') for text_name in text_names]
-	if audio_num != text_num:
-		raise ValueError(f'Audio file numbers do not match item numbers in transcription file {transcription_file!r}.')
+	# cut at whole samples, so the offsets are exact
+	segments = [(round(start * sample_rate), round(end * sample_rate), first, last) for start, end, first, last in segments]
 	
-	audio_text = dict(zip(audio_names, text_names))
+	def align_segment(i: int, start: int, end: int, first: int, last: int) -> requests.Response:
+		segment = io.BytesIO()
+		with wave.open(segment, 'wb') as out_file:
+			out_file.setnchannels(1)
+			out_file.setsampwidth(2)
+			out_file.setframerate(sample_rate)
+			out_file.writeframes(pcm[start * 2:end * 2])
+		
+		return post_alignment(
+			**kwargs,
+			audio_file=f'{os.path.splitext(audio_file)[0]}_{i}.wav',
+			audio=segment.getvalue(),
+			text_file=text_file,
+			transcript=text[first:last].encode('utf-8'),
+			timeout=timeout + timeout_factor * (end - start) / sample_rate if timeout is not None else None
+		)
 	
-	return audio_text
+	if executor is not None:
+		responses = list(executor.map(align_segment, range(len(segments)), *zip(*segments)))
+	else:
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			responses = list(executor.map(align_segment, range(len(segments)), *zip(*segments)))
+	
+	for r in responses:
+		if not r.ok:
+			return None, r
+	
+	alignment = stitch_alignments(
+		transcript=text, 
+		alignments=[parse_alignment(r.content) for r in responses], 
+		offsets=[(start / sample_rate, first) for start, _, first, _ in segments]
+	)
+	return json.dumps(alignment, indent=2).encode('utf-8'), None
 
 def save_alignments(
 	sound_dir: str, 
-	text_dir: str, 
+	text_dir: Optional[str], 
 	transcription_file: str, 
 	gentle_url: str, 
-	gentle_params: Dict
+	gentle_params: Dict,
+	jobs: int = 1,
+	gentle_pool: GentlePool = None,
+	cache: AlignmentCache = None,
+	resume: bool = False,
+	transcriptions: Dict[str,bytes] = None,
+	on_aligned: Callable[[str], None] = None,
+	on_failed: Callable[[str], None] = None,
+	batch: bool = False,
+	poll_interval: float = 0.5,
+	max_poll_interval: float = 10,
+	audio_cache: AlignmentCache = None,
+	sound_index: DirectoryIndex = None,
+	metrics: Metrics = None,
+	timeout: float = 60,
+	timeout_factor: float = 5,
+	retries: int = 2,
+	hedge: bool = True,
+	split: float = 0,
+	split_silence: float = 0.5
 ) -> str:
 	'''
 	Uses gentle to get alignments between text and sound files. Saves results to disk.
+	If transcriptions (from get_transcriptions) are provided, they are sent to gentle
+	directly, and text_dir is not used.
+	Up to jobs alignments are sent to gentle at once over a shared keep-alive session.
+	If a gentle_pool is provided, requests are spread across its instances instead of gentle_url.
+	If a cache is provided, items already in it are not sent to gentle again.
+	Each item is recorded in the sound directory's manifest. If resume is set, the 
+	previous alignment directory is reused, and only items that are missing, failed, 
+	or whose inputs changed are aligned.
+	If on_aligned is provided, it is called with the name of each json file once it is saved.
+	Each request waits for gentle for up to timeout seconds plus timeout_factor seconds per second of audio,
+	and requests that time out or get a server error are tried again up to retries times. If hedge is set, 
+	slow requests are also sent to a second instance in gentle_pool, if there is one (see GentlePool.post).
+	Items that still cannot be aligned are not saved. Instead, they are listed in failures.csv in the 
+	alignment directory, and on_failed is called with the name of the json file, if it is provided.
+	If split is set, recordings longer than split seconds are split at pauses at least split_silence seconds long,
+	and the segments are aligned at the same time (see post_alignment_in_segments).
+	All of the alignments are also saved together in a WordStore in the words directory in the alignment directory.
+	If batch is set, items are submitted to gentle's asynchronous API (gentle_params should include 
+	async=true), and the jobs are polled with backoff (from poll_interval up to max_poll_interval 
+	seconds) and downloaded as they finish, instead of waiting for each alignment. A job fails if it 
+	cannot be checked, and then cannot be checked again retries more times in a row.
+	If an audio_cache is provided, each mp3 that is uploaded is preconditioned with precondition_audio 
+	first; this runs in parallel ahead of the uploads. Items that are skipped or in the cache aren't preconditioned.
+	If a sound_index is provided, it is used instead of listing sound_dir again.
+	If metrics are provided, how long each stage takes for each item is recorded in them.
 	Returns the name of the directory where results are saved.
 	'''
-	audio_text = get_mp3_to_text_mapping(sound_dir=sound_dir, text_dir=text_dir, transcription_file=transcription_file)
-	align_dir  = make_new_dir(prefix=os.path.join(sound_dir, 'gentle_align'), suffix='')
-	for audio, text in audio_text.items():
-		audio_file = os.path.join(sound_dir, audio)
-		text_file  = os.path.join(text_dir, text)
+	metrics = metrics if metrics is not None else Metrics()
+	gentle_pool = gentle_pool if gentle_pool is not None else GentlePool([gentle_url], metrics=metrics)
+	if transcriptions is not None:
+		audio_text = {
+			audio_name: f'{item}.txt' 
+			for audio_name, item in get_mp3_to_transcript_mapping(
+				sound_dir=sound_dir, 
+				transcriptions=transcriptions, 
+				transcription_file=transcription_file,
+				sound_index=sound_index
+			).items()
+		}
+	else:
+		audio_text = get_mp3_to_text_mapping(
+			sound_dir=sound_dir, 
+			text_dir=text_dir, 
+			transcription_file=transcription_file, 
+			sound_index=sound_index
+		)
+	
+	# whether gentle runs asynchronously doesn't change the alignment
+	key_params = {k: v for k, v in gentle_params.items() if k != 'async'}
+	if audio_cache is not None:
+		key_params['precondition'] = True
+	params_str = json.dumps(key_params, sort_keys=True)
+	
+	# splitting changes the alignment of long recordings, but not the others
+	split_params = {**key_params, 'split': split, 'split_silence': split_silence}
+	split_params_str = json.dumps(split_params, sort_keys=True)
+	
+	# maps json files to (instance, job url, audio name, text name, record, cache key, resubmittable) for batch jobs,
+	# where resubmittable is whether to submit the job again if gentle no longer has it
+	pending = {}
+	
+	# how many times in a row each batch job could not be checked, and when to check it again
+	check_errors = {}
+	
+	# when each item was started and each batch job was submitted, to record how long they take
+	started = {}
+	submitted = {}
+	
+	# items that could not be aligned
+	failures = []
+	
+	# every alignment, to save together at the end
+	store = WordStore()
+	
+	with AlignmentManifest(sound_dir) as manifest:
+		entry = manifest.entry(transcription_file)
+		previous = entry['items'] if resume else {}
+		if resume and entry['align_dir'] and os.path.isdir(os.path.join(sound_dir, entry['align_dir'])):
+			align_dir = os.path.join(sound_dir, entry['align_dir'])
+			
+			# remove alignments for items that are no longer in the transcription file
+			json_names = [text.replace('.txt', '.json') for text in audio_text.values()]
+			for json_name in [json_name for json_name in previous if not json_name in json_names]:
+				if os.path.isfile(os.path.join(align_dir, json_name)):
+					os.remove(os.path.join(align_dir, json_name))
+				
+				del previous[json_name]
+		else:
+			align_dir = make_new_dir(prefix=os.path.join(sound_dir, 'gentle_align'), suffix='')
+			entry['align_dir'] = os.path.relpath(align_dir, sound_dir)
+			entry['items'] = {}
+		
+		def save(json_name: str, record: Dict, key: str, content: bytes, cached: bool = False) -> None:
+			with metrics.time('save_alignment'):
+				# only save and cache what gentle sent if it is really an alignment
+				try:
+					alignment = parse_alignment(content)
+				except ValueError as e:
+					fail(json_name, record, f'invalid JSON from gentle: {e} ({content[:100]!r})')
+					return
+				
+				if cache is not None and not cached:
+					cache.put(key, content)
+				
+				with open(os.path.join(align_dir, json_name), 'wb') as out_file:
+					out_file.write(content)
+				
+				store.append(re.sub(r'\.json$', '', json_name), alignment)
+				manifest.update(transcription_file, json_name, **record, status='done')
+			
+			metrics.item(
+				transcription_file=transcription_file, 
+				item=re.sub(r'\.json$', '', json_name), 
+				seconds=time.perf_counter() - started.pop(json_name, time.perf_counter()), 
+				status='done'
+			)
+			
+			if on_aligned is not None:
+				on_aligned(os.path.join(align_dir, json_name))
+		
+		def fail(json_name: str, record: Dict, error: str) -> None:
+			log.warning(f'Unable to align {record["audio"]!r}: {error}')
+			
+			# don't leave an alignment from a previous run for an item that failed this time
+			if os.path.isfile(os.path.join(align_dir, json_name)):
+				os.remove(os.path.join(align_dir, json_name))
+			
+			manifest.update(transcription_file, json_name, **record, status='failed', error=error)
+			failures.append({'item': re.sub(r'\.json$', '', json_name), 'audio': record['audio'], 'error': error})
+			metrics.count('alignments_failed')
+			metrics.item(
+				transcription_file=transcription_file, 
+				item=re.sub(r'\.json$', '', json_name), 
+				seconds=time.perf_counter() - started.pop(json_name, time.perf_counter()), 
+				status='failed'
+			)
+			
+			if on_failed is not None:
+				on_failed(os.path.join(align_dir, json_name))
+		
+		def describe(r: requests.Response) -> str:
+			'''Describes an error response from gentle.'''
+			return f'gentle returned {r.status_code} {r.reason}: {r.text.strip()[:200]!r}'
 		
-		with open(audio_file, 'rb') as audio_mp3, open(text_file, 'rb') as text_txt:
-			files = {
-				'audio': (audio_file, audio_mp3, 'audio/mpeg'), 
-				'transcript': (text_file, text_txt, 'text/plain')
+		def read_item(audio_name: str, text_name: str) -> Tuple[str, bytes, str, bytes, bool, Dict, str]:
+			'''
+			Reads an item's audio and transcription. Returns the audio file, audio, text file, transcription, 
+			whether it will be split, its record for the manifest, and its cache key.
+			'''
+			audio_file = os.path.join(sound_dir, audio_name)
+			with open(audio_file, 'rb') as audio_mp3:
+				audio = audio_mp3.read()
+			
+			if transcriptions is not None:
+				text_file  = text_name
+				transcript = transcriptions[re.sub(r'\.txt$', '', text_name)]
+			else:
+				text_file  = os.path.join(text_dir, text_name)
+				with open(text_file, 'rb') as text_txt:
+					transcript = text_txt.read()
+			
+			splitting = bool(split) and get_audio_seconds(audio) > split
+			record = {
+				'audio': audio_name,
+				'audio_hash': hashlib.sha256(audio).hexdigest(),
+				'transcript_hash': hashlib.sha256(transcript).hexdigest(),
+				'params': split_params_str if splitting else params_str,
 			}
+			key = (
+				cache.key(record['audio_hash'], record['transcript_hash'], split_params if splitting else key_params) 
+				if cache is not None else None
+			)
+			
+			return audio_file, audio, text_file, transcript, splitting, record, key
+		
+		def is_aligned(json_name: str, record: Dict) -> bool:
+			'''Checks whether an item was already aligned from the same inputs.'''
+			return (
+				previous.get(json_name, {}) == {**record, 'status': 'done'} and 
+				os.path.isfile(os.path.join(align_dir, json_name))
+			)
+		
+		def is_submitted(json_name: str, record: Dict) -> bool:
+			'''Checks whether an item was submitted to gentle as a batch job from the same inputs in a previous run.'''
+			return batch and {k: v for k, v in previous.get(json_name, {}).items() if k != 'job'} == {**record, 'status': 'submitted'}
+		
+		def align(audio_name: str, text_name: str, resubmit: bool = False) -> None:
+			json_name  = text_name.replace('.txt', '.json')
+			started.setdefault(json_name, time.perf_counter())
+			with metrics.time('read_audio'):
+				audio_file, audio, text_file, transcript, splitting, record, key = read_item(audio_name, text_name)
+			
+			# skip items that were already aligned from the same inputs
+			if is_aligned(json_name, record):
+				started.pop(json_name, None)
+				metrics.count('items_skipped')
+				store.append(re.sub(r'\.json$', '', json_name), load_json(os.path.join(align_dir, json_name)))
+				if on_aligned is not None:
+					on_aligned(os.path.join(align_dir, json_name))
+				
+				return
+			
+			# pick up batch jobs that were submitted to gentle in a previous run
+			if not resubmit and is_submitted(json_name, record):
+				pending[json_name] = (None, previous[json_name]['job'], audio_name, text_name, record, key, True)
+				return
+			
+			manifest.update(transcription_file, json_name, **record, status='started')
+			try:
+				content = cache.get(key) if cache is not None else None
+				if cache is not None:
+					metrics.count('cache_hits' if content is not None else 'cache_misses')
+				
+				if content is not None:
+					save(json_name, record, key, content, cached=True)
+					return
+				
+				# only audio that is actually uploaded needs to be preconditioned
+				if audio_cache is not None:
+					with metrics.time('precondition'):
+						if audio_name in preconditioning:
+							preconditioning[audio_name].result()
+						
+						audio = precondition_audio(audio, audio_cache)
+				
+				if splitting:
+					metrics.count('split_items')
+					with metrics.time('align_split'):
+						try:
+							content, r = post_alignment_in_segments(
+								session=session,
+								gentle_pool=gentle_pool,
+								gentle_params={**gentle_params, 'async': 'false'},
+								audio_file=audio_file,
+								audio=audio,
+								text_file=text_file,
+								transcript=transcript,
+								max_seconds=split,
+								min_silence=split_silence,
+								jobs=jobs,
+								timeout=timeout,
+								timeout_factor=timeout_factor,
+								retries=retries,
+								hedge=hedge,
+								executor=segmenter
+							)
+						except ValueError as e:
+							fail(json_name, record, f'invalid JSON from gentle: {e}')
+							return
+					
+					if content is not None:
+						save(json_name, record, key, content)
+					else:
+						fail(json_name, record, describe(r))
+					
+					return
+				
+				metrics.count('uploaded_bytes', len(audio) + len(transcript))
+				deadline = get_deadline(audio, timeout=timeout, timeout_factor=timeout_factor)
+				if batch:
+					with metrics.time('submit'):
+						instance, r = submit_alignment(
+							session=session,
+							gentle_pool=gentle_pool,
+							gentle_params=gentle_params,
+							audio_file=audio_file,
+							audio=audio,
+							text_file=text_file,
+							transcript=transcript,
+							timeout=deadline,
+							retries=retries
+						)
+					
+					if r.status_code in (301, 302, 303, 307) and 'Location' in r.headers:
+						job = requests.compat.urljoin(instance, r.headers['Location']).rstrip('/')
+						submitted[json_name] = time.perf_counter()
+						pending[json_name] = (instance, job, audio_name, text_name, record, key, not resubmit)
+						manifest.update(transcription_file, json_name, **record, status='submitted', job=job)
+						return
+					
+					# gentle answered right away instead of giving us a job
+					gentle_pool.release(instance)
+				else:
+					with metrics.time('align'):
+						r = post_alignment(
+							session=session,
+							gentle_pool=gentle_pool,
+							gentle_params=gentle_params,
+							audio_file=audio_file,
+							audio=audio,
+							text_file=text_file,
+							transcript=transcript,
+							timeout=deadline,
+							retries=retries,
+							hedge=hedge
+						)
+				
+				if r.ok:
+					save(json_name, record, key, r.content)
+				else:
+					fail(json_name, record, describe(r))
+			except requests.exceptions.RequestException as e:
+				# there's no point going on if gentle can't be reached at all
+				if not gentle_pool.is_alive():
+					manifest.update(transcription_file, json_name, **record, status='failed')
+					raise
+				
+				fail(json_name, record, f'{type(e).__name__}: {e}')
+			except Exception:
+				manifest.update(transcription_file, json_name, **record, status='failed')
+				raise
+		
+		def check(json_name: str) -> bool:
+			'''
+			Checks on a batch job, saving its alignment if it is finished. Returns whether the job is done.
+			If gentle can't be reached, the job is checked again later, and only fails if it can't be checked again retries more times in a row.
+			'''
+			instance, job, audio_name, text_name, record, key, resubmittable = pending[json_name]
+			errors, retry_at = check_errors.get(json_name, (0, 0))
+			if time.perf_counter() < retry_at:
+				return False
+			
+			try:
+				status = session.get(f'{job}/status.json', timeout=timeout)
+				metrics.count('status_checks')
+				state = status.json().get('status') if status.ok else 'ERROR'
+				r = session.get(f'{job}/align.json', timeout=timeout) if state == 'OK' else None
+			except requests.exceptions.RequestException as e:
+				errors += 1
+				if errors <= retries:
+					# wait longer after each failed check, like GentlePool.submit
+					check_errors[json_name] = (errors, time.perf_counter() + random.uniform(1, 2) * 2 ** errors)
+					log.warning(f'Unable to check on the job for {json_name!r} ({type(e).__name__}). Trying again.')
+					metrics.count('retries')
+					return False
+				
+				fail(json_name, record, f'{type(e).__name__}: {e}')
+				check_errors.pop(json_name, None)
+				submitted.pop(json_name, None)
+				if instance is not None:
+					gentle_pool.release(instance)
+				
+				return True
+			
+			check_errors.pop(json_name, None)
+			if status.status_code == 404 and resubmittable:
+				# gentle doesn't have the job anymore (maybe it was restarted), so submit it again once
+				if instance is not None:
+					gentle_pool.release(instance)
+				
+				log.warning(f'gentle no longer has the job for {json_name!r}. Submitting it again.')
+				job_entry = pending[json_name]
+				align(audio_name, text_name, resubmit=True)
+				
+				# if it wasn't submitted as a new job, it has already been saved or failed
+				return pending[json_name] is job_entry
+			
+			if state in ('OK', 'ERROR') and json_name in submitted:
+				metrics.record('gentle_job', time.perf_counter() - submitted.pop(json_name))
+			
+			if state == 'OK':
+				if r.ok:
+					save(json_name, record, key, r.content)
+				else:
+					fail(json_name, record, describe(r))
+			elif state == 'ERROR':
+				fail(json_name, record, describe(status) if not status.ok else f'gentle was unable to align it ({job})')
+			else:
+				return False
+			
+			if instance is not None:
+				gentle_pool.release(instance)
 			
-			# this gets the alignment data from gentle
-			r = requests.post(gentle_url, params=gentle_params, files=files)
+			return True
 		
-		with open(os.path.join(align_dir, text.replace('.txt', '.json')), 'wb') as out_file:
-			out_file.write(r.content)
+		with requests.Session() as session:
+			# keep one connection open per worker (and segment and hedged request) so they are reused between items
+			adapter = requests.adapters.HTTPAdapter(
+				pool_connections=len(gentle_pool.urls), 
+				pool_maxsize=jobs * (2 if split else 1) * (2 if hedge else 1)
+			)
+			session.mount('http://', adapter)
+			# segments of split items share one set of workers, so that at most jobs segments are sent at once
+			with ThreadPoolExecutor(max_workers=jobs) as executor, ThreadPoolExecutor(max_workers=os.cpu_count()) as preconditioner, ThreadPoolExecutor(max_workers=jobs) as segmenter:
+				# convert the audio ahead of the uploads, so that it's ready in the cache when it's needed
+				preconditioning = {}
+				if audio_cache is not None:
+					def precondition_file(audio_name: str, text_name: str) -> None:
+						# items that will be skipped or taken from the cache aren't uploaded, so they don't need converting
+						_, audio, _, _, _, record, key = read_item(audio_name, text_name)
+						json_name = text_name.replace('.txt', '.json')
+						if is_aligned(json_name, record) or is_submitted(json_name, record) or (cache is not None and cache.has(key)):
+							return
+						
+						precondition_audio(audio, audio_cache)
+					
+					preconditioning = {
+						audio_name: preconditioner.submit(precondition_file, audio_name, text_name) 
+						for audio_name, text_name in audio_text.items()
+					}
+				
+				# list forces any exception raised in a worker to be raised here
+				list(executor.map(align, audio_text.keys(), audio_text.values()))
+				
+				# poll the batch jobs until they're all done, checking less often while nothing finishes
+				delay = poll_interval
+				while pending:
+					time.sleep(delay)
+					waiting = list(pending)
+					done = [json_name for json_name, finished in zip(waiting, executor.map(check, waiting)) if finished]
+					for json_name in done:
+						del pending[json_name]
+					
+					delay = poll_interval if done else min(delay * 1.5, max_poll_interval)
+	
+	with metrics.time('save_word_store'):
+		store.save(os.path.join(align_dir, 'words'))
+	
+	# list the items that could not be aligned, so they can be checked and aligned again with --resume
+	report = os.path.join(align_dir, 'failures.csv')
+	if failures:
+		pd.DataFrame(failures).to_csv(report, index=False)
+		log.warning(f'{len(failures)} item(s) from {transcription_file!r} could not be aligned. See {report!r}.')
+	elif os.path.isfile(report):
+		os.remove(report)
 	
 	return align_dir
 
+def parse_json(content: bytes) -> Dict:
+	'''Parses json, using orjson if it is installed since it is much faster.'''
+	return orjson.loads(content) if orjson is not None else json.loads(content)
+
+def parse_alignment(content: bytes) -> Dict:
+	'''Parses an alignment from gentle, raising a ValueError if it isn't one (e.g., if it is an error page).'''
+	alignment = parse_json(content)
+	if not isinstance(alignment, dict) or not isinstance(alignment.get('words'), list):
+		raise ValueError('it has no words')
+	
+	return alignment
+
+def load_json(file: str) -> Dict:
+	'''Loads a json file, using orjson if it is installed since it is much faster.'''
+	with open(file, 'rb') as in_file:
+		return parse_json(in_file.read())
+
+def get_word_timings(words: List[Dict]) -> List[Tuple[str, float, float, float]]:
+	'''
+	Gets the timing information for each aligned word from gentle.
+	
+		params:
+			words (List[Dict]): gentle's word entries that have alignments
+		
+		returns:
+			a list of (word, onset, offset, duration) tuples, beginning with the silence before
+			the first word ('SOL'). Onsets and offsets are in seconds; durations are in ms, and 
+			run until the start of the next word.
+	'''
+	timings = []
+	for i, alignment in enumerate(words):
+		# Get the word and its starting and ending position
+		word = alignment['alignedWord']
+		onset = alignment['start']
+		offset = alignment['end']
+		
+		# If it's the first word, add the silence before its onset
+		if i == 0:
+			diff = round(float(onset), 4) * 1000
+			timings.append(('SOL', 0., float(onset), diff))
+		
+		# Get the duration of the word
+		# Starting point of the word
+		pre = round(float(onset), 4) * 1000
+		
+		# If it's the last word, then the ending time is the end of that word
+		if alignment == words[-1]:
+			post = round(float(offset), 4) * 1000
+		# Otherwise, the ending time is the starting point of the next word
+		else:
+			post = round(float(words[i+1]['start']), 4) * 1000
+		
+		# Duration is the difference between ending and starting time
+		diff = post - pre
+		timings.append((word, float(onset), float(offset), diff))
+	
+	return timings
+
 def save_json_as_textgrid(
 	file: str,
 	max_words: int = 20,
 	output_dir: str = '.',
 	return_pd_series: bool = False,
-	pd_colnames: List[str] = None
-) -> pd.Series:
+	pd_colnames: List[str] = None,
+	return_timings: bool = False,
+	prompt: bool = True,
+	words: List[Dict] = None
+) -> Union[pd.Series, List[Tuple[str, float, float, float]]]:
 	'''
 	Saves a json with duration information as a praat TextGrid.
-	Optionally returns a pd Series containing duration information for each word.
+	Optionally returns a pd Series containing duration information for each word,
+	or, if return_timings is set, the unpadded list of timings from get_word_timings.
+	If gentle found no words, returns None, after waiting for the user to confirm if prompt is set.
+	If words are provided (like from MappedWordStore.words), they are used instead of loading file.
 	'''
 	item_number = re.sub(r'\.json$', '', os.path.split(file)[-1])
-	dur_row = [item_number]
-	word_row = []
 	
 	# Load the alignment file
-	with open(file, 'rt') as in_file:
-		words = json.load(in_file)['words']
+	if words is None:
+		words = load_json(file)['words']
 	
 	# Remove entries without alignments
 	words = [word for word in words if 'alignedWord' in word]
 	
 	# If gentle couldn't find any words, skip this one
 	if not words:
-		input(
-			f'gentle found no words in {grid!r}. '
-			'No durations will be saved for this item, '
-			'and the TextGrid file will be empty. Press any key to continue.'
-		)
+		if prompt:
+			prompt_no_words(file)
+		
 		return
 	
 	textgrid_file = os.path.join(output_dir, f'{item_number}_praat.TextGrid')
@@ -481,42 +2536,23 @@ def save_json_as_textgrid(
 		
 		# For each word with alignment info
 		for i, alignment in enumerate(words):
-			# Get the word and its starting and ending position
-			word = alignment['alignedWord']
-			onset = alignment['start']
-			offset = alignment['end']
-			
 			# If it's the first word, write silence before its onset
 			if i == 0:
-				out_file.write(f'0\n{onset}\n"{{SL}}"')
-				diff = round(float(onset), 4) * 1000
-				dur_row.append(diff)
-				word_row.append('SOL')
-			
-			# Get the duration of the word
-			# Starting point of the word
-			pre = round(float(onset), 4) * 1000
-			
-			# If it's the last word, then the ending time is the end of that word
-			if alignment == words[-1]:
-				post = round(float(offset), 4) * 1000
-			# Otherwise, the ending time is the starting point of the next word
-			else:
-				post = round(float(words[i+1]['start']), 4) * 1000
-			
-			# Duration is the difference between ending and starting time
-			diff = post - pre
-			dur_row.append(diff)
-			
-			# Add the word with that duration to the word row
-			word_row.append(word)
+				out_file.write(f'0\n{alignment["start"]}\n"{{SL}}"')
 			
 			# Write its onset, offset, and text to the TextGrid
-			out_file.write(f'\n{onset}')
-			out_file.write(f'\n{offset}')
-			out_file.write(f'\n"{word}"')
+			out_file.write(f'\n{alignment["start"]}')
+			out_file.write(f'\n{alignment["end"]}')
+			out_file.write(f'\n"{alignment["alignedWord"]}"')
+	
+	timings = get_word_timings(words)
+	if return_timings:
+		return timings
 	
 	if return_pd_series:
+		dur_row = [item_number] + [duration for _, _, _, duration in timings]
+		word_row = [word for word, _, _, _ in timings]
+		
 		# Fill out the durations row with zeros (have to add one because of the item number column)
 		while len(dur_row) < max_words + 1:
 			dur_row.append(0)
@@ -546,6 +2582,156 @@ def save_json_as_textgrid(
 		
 		return row
 
+def prompt_no_words(file: str) -> None:
+	'''Lets the user know that gentle found no words in an alignment file.'''
+	input(
+		f'gentle found no words in {file!r}. '
+		'No durations will be saved for this item, '
+		'and the TextGrid file will be empty. Press any key to continue.'
+	)
+
+def timed(function: Callable, *args, **kwargs) -> Tuple[float, Any]:
+	'''Calls function, and returns how long it took along with what it returned. Works in other processes.'''
+	start = time.perf_counter()
+	result = function(*args, **kwargs)
+	return time.perf_counter() - start, result
+
+def save_jsons_as_textgrids(
+	files: List[str],
+	jobs: int = 1,
+	metrics: Metrics = None,
+	**kwargs
+) -> List[Union[pd.Series, List[Tuple[str, float, float, float]]]]:
+	'''
+	Calls save_json_as_textgrid on each file, using a pool of jobs processes if jobs > 1.
+	Keyword arguments are passed to save_json_as_textgrid.
+	If metrics are provided, how long each file takes is recorded in them.
+	Returns the results in the same order as files.
+	'''
+	if jobs == 1 or len(files) <= 1:
+		results = [timed(save_json_as_textgrid, file=file, **kwargs) for file in files]
+	else:
+		with ProcessPoolExecutor(max_workers=jobs) as executor:
+			results = list(executor.map(
+				partial(timed, save_json_as_textgrid, prompt=False, **kwargs), 
+				files, 
+				chunksize=max(1, len(files) // (jobs * 4))
+			))
+		
+		# the worker processes can't ask for input, so we do it here
+		for file, (_, result) in zip(files, results):
+			if result is None:
+				prompt_no_words(file)
+	
+	if metrics is not None:
+		for seconds, _ in results:
+			metrics.record('extract', seconds)
+	
+	return [result for _, result in results]
+
+def get_duration_columns(item_col: str, max_words: int) -> List[str]:
+	'''Gets the column names for the durations: the item column, then R00... for durations and W00... for words.'''
+	return (
+		[item_col] + 
+		[f'R{num:0{len(str(max_words))}d}' for num in range(max_words)] + 
+		[f'W{num:0{len(str(max_words))}d}' for num in range(max_words)]
+	)
+
+def get_extraction_kwargs(
+	item_col: str,
+	max_words: int,
+	output_format: str,
+	output_dir: str
+) -> Dict:
+	'''Gets the arguments to save_json_as_textgrid for the output format.'''
+	if output_format != 'csv':
+		return dict(output_dir=output_dir, return_timings=True)
+	
+	return dict(
+		max_words=max_words, 
+		output_dir=output_dir, 
+		return_pd_series=True,
+		pd_colnames=get_duration_columns(item_col=item_col, max_words=max_words)
+	)
+
+def save_results(
+	align_dir: str,
+	sound_dir: str,
+	transcription_file: str,
+	stimuli_file: str,
+	item_col: str,
+	max_words: int = 20,
+	output_format: str = 'csv',
+	extract_jobs: int = 1,
+	results: Dict[str,Union[pd.Series, List[Tuple[str, float, float, float]]]] = None,
+	metrics: Metrics = None
+) -> None:
+	'''
+	Saves TextGrids and durations for every alignment in align_dir.
+	results maps json files that have already been passed to save_json_as_textgrid 
+	(with prompt=False) to its output; these are not processed again.
+	Alignments in align_dir's word store (see open_word_store) are read from it instead of their json files.
+	If metrics are provided, how long extracting each item and saving the durations take are recorded in them.
+	'''
+	metrics = metrics if metrics is not None else Metrics()
+	# Get the list of json files with the gentle alignment info
+	grids = [os.path.join(align_dir, grid) for grid in DirectoryIndex(align_dir).files('.json')]
+	
+	results = dict(results) if results is not None else {}
+	for grid in grids:
+		if grid in results and results[grid] is None:
+			prompt_no_words(grid)
+	
+	missing = [grid for grid in grids if not grid in results]
+	extraction_kwargs = get_extraction_kwargs(item_col=item_col, max_words=max_words, output_format=output_format, output_dir=sound_dir)
+	
+	# the word store is already parsed, so these don't need to be sent to other processes
+	store = open_word_store(align_dir)
+	if store is not None:
+		for grid in missing:
+			item = re.sub(r'\.json$', '', os.path.split(grid)[-1])
+			if item in store:
+				seconds, results[grid] = timed(save_json_as_textgrid, file=grid, words=store.words(item), **extraction_kwargs)
+				metrics.record('extract', seconds)
+		
+		missing = [grid for grid in missing if not grid in results]
+	
+	results.update(zip(missing, save_jsons_as_textgrids(
+		files=missing,
+		jobs=extract_jobs,
+		metrics=metrics,
+		**extraction_kwargs
+	)))
+	
+	# Save the timing info one row per word, with no maximum
+	if output_format != 'csv':
+		timings = WordTimingTable()
+		for grid in grids:
+			timings.append(
+				file=transcription_file,
+				item=re.sub(r'\.json$', '', os.path.split(grid)[-1]),
+				timings=results[grid]
+			)
+		
+		with metrics.time('save_durations'):
+			timings.save(output_dir=sound_dir, output_format=output_format)
+		
+		return
+	
+	# Set up a table to hold the timing info
+	durations = DurationTable(columns=get_duration_columns(item_col=item_col, max_words=max_words), size=len(grids))
+	for grid in grids:
+		durations.append(results[grid])
+	
+	with metrics.time('save_durations'):
+		save_durations(
+			durations=durations.to_frame(), 
+			stimuli_file=stimuli_file, 
+			item_col=item_col, 
+			transcription_file=transcription_file, 
+			output_dir=sound_dir
+		)
+
 def save_durations(
 	durations: pd.DataFrame,
 	stimuli_file: str,
@@ -585,64 +2771,249 @@ def save_durations(
 		
 		durations.to_csv(all_csv, index=False)
 
-def align_text_to_audio() -> None:
+def run_pipeline(
+	args: 'argparse.Namespace',
+	gentle_url: str,
+	gentle_params: Dict,
+	gentle_pool: GentlePool = None,
+	cache: AlignmentCache = None,
+	audio_cache: AlignmentCache = None,
+	metrics: Metrics = None,
+	progress: tqdm = None
+) -> None:
 	'''
-	Main function. Handles aligning text to audio
-	and writing out results.
+	Aligns each transcription file like align_text_to_audio, but with the steps overlapped.
+	While gentle aligns one file, the transcriptions for the next file are read, TextGrids and 
+	durations are extracted for items as soon as gentle finishes them, and the durations for 
+	the previous file are saved. At most a few jobs' worth of items wait for extraction at once.
+	If a progress bar is provided, it is updated as each item is aligned.
 	'''
-	args = parse_arguments()
-	url = f'http://localhost:{args.port}/transcriptions'
-	params = {'async' : 'false'}
-	
-	with GentleListener(port=args.port, docker_location=args.docker_location, wait=args.wait):
-		for transcription_file, sound_dir, stimuli_file in tqdm(
-			zip(args.transcription_files, args.sound_dirs, args.stimuli_files), 
-			total=len(args.transcription_files)
-		):
-			with TempDir(prefix=os.path.join(sound_dir, 'transcription_')) as text_dir:
-				save_transcriptions_to_text(
-					transcription_file=transcription_file, 
-					item_col=args.item, 
-					transcription_col=args.transcription, 
-					output_dir=text_dir
-				)
-				
-				align_dir = save_alignments(
-					sound_dir=sound_dir, 
-					text_dir=text_dir, 
-					transcription_file=transcription_file, 
-					gentle_url=url, 
-					gentle_params=params
-				)
+	files = list(zip(args.transcription_files, args.sound_dirs, args.stimuli_files))
+	metrics = metrics if metrics is not None else Metrics()
+	
+	def prepare(transcription_file: str) -> Dict[str,bytes]:
+		with metrics.time('read_transcriptions'):
+			return get_transcriptions(
+				transcription_file=transcription_file, 
+				item_col=args.item, 
+				transcription_col=args.transcription
+			)
+	
+	# extraction happens in threads unless we have multiple processes to use
+	extractor = (
+		ProcessPoolExecutor(max_workers=args.extract_jobs) if args.extract_jobs > 1 
+		else ThreadPoolExecutor(max_workers=1)
+	)
+	# limit how many finished items can wait to be extracted
+	waiting = threading.BoundedSemaphore(4 * max(args.jobs, args.extract_jobs))
+	
+	with ThreadPoolExecutor(max_workers=1) as preparer, ThreadPoolExecutor(max_workers=1) as finisher, extractor:
+		finishing = []
+		next_transcriptions = preparer.submit(prepare, files[0][0]) if files else None
+		for i, (transcription_file, sound_dir, stimuli_file) in enumerate(files):
+			if progress is not None:
+				progress.set_postfix_str(os.path.basename(transcription_file))
+			
+			transcriptions = next_transcriptions.result()
+			if i + 1 < len(files):
+				next_transcriptions = preparer.submit(prepare, files[i + 1][0])
+			
+			extraction_kwargs = get_extraction_kwargs(
+				item_col=args.item, 
+				max_words=args.max_words, 
+				output_format=args.output_format, 
+				output_dir=sound_dir
+			)
+			extracting = {}
 			
-			# Get the list of json files with the gentle alignment info
-			grids = sort_human([file for file in os.listdir(align_dir) if file.endswith('.json')])
-			grids = [os.path.join(align_dir, grid) for grid in grids]
+			def on_aligned(grid: str) -> None:
+				if progress is not None:
+					progress.update()
+				
+				waiting.acquire()
+				future = extractor.submit(timed, save_json_as_textgrid, file=grid, prompt=False, **extraction_kwargs)
+				future.add_done_callback(lambda future: waiting.release())
+				extracting[grid] = future
 			
-			# Set up a dataframe to hold the timing info
-			durations = pd.DataFrame(
-				columns = [args.item] + 
-					[f'R{num:0{len(str(args.max_words))}d}' for num in range(args.max_words)] + 
-					[f'W{num:0{len(str(args.max_words))}d}' for num in range(args.max_words)]
+			align_dir = save_alignments(
+				sound_dir=sound_dir, 
+				text_dir=None, 
+				transcription_file=transcription_file, 
+				gentle_url=gentle_url, 
+				gentle_params=gentle_params,
+				jobs=args.jobs,
+				gentle_pool=gentle_pool,
+				cache=cache,
+				resume=args.resume,
+				batch=args.batch,
+				audio_cache=audio_cache,
+				transcriptions=transcriptions,
+				on_aligned=on_aligned,
+				on_failed=(lambda grid: progress.update()) if progress is not None else None,
+				sound_index=args.sound_dir_indexes.get(sound_dir),
+				metrics=metrics,
+				timeout=args.timeout,
+				timeout_factor=args.timeout_factor,
+				retries=args.retries,
+				hedge=not args.no_hedge,
+				split=args.split,
+				split_silence=args.split_silence
 			)
 			
-			for grid in grids:
-				row = save_json_as_textgrid(
-					file=grid, 
-					max_words=args.max_words, 
-					output_dir=sound_dir, 
-					return_pd_series=True,
-					pd_colnames=durations.columns,
+			def finish(
+				align_dir: str, 
+				sound_dir: str, 
+				transcription_file: str, 
+				stimuli_file: str, 
+				extracting: Dict[str,Future]
+			) -> None:
+				results = {}
+				for grid, future in extracting.items():
+					seconds, results[grid] = future.result()
+					metrics.record('extract', seconds)
+				
+				save_results(
+					align_dir=align_dir,
+					sound_dir=sound_dir,
+					transcription_file=transcription_file,
+					stimuli_file=stimuli_file,
+					item_col=args.item,
+					max_words=args.max_words,
+					output_format=args.output_format,
+					extract_jobs=args.extract_jobs,
+					results=results,
+					metrics=metrics
 				)
-				durations = durations.append(row, ignore_index=True)
 			
-			save_durations(
-				durations=durations, 
-				stimuli_file=stimuli_file, 
-				item_col=args.item, 
+			finishing.append(finisher.submit(finish, align_dir, sound_dir, transcription_file, stimuli_file, extracting))
+		
+		# raise any errors from saving the results
+		for future in finishing:
+			future.result()
+
+def align_files(
+	args: 'argparse.Namespace',
+	gentle_url: str,
+	gentle_params: Dict,
+	gentle_pool: GentlePool = None,
+	cache: AlignmentCache = None,
+	audio_cache: AlignmentCache = None,
+	metrics: Metrics = None,
+	progress: tqdm = None
+) -> None:
+	'''
+	Aligns each transcription file and saves the results, one file after another, 
+	or overlapped using run_pipeline if args.pipeline is set.
+	If a progress bar is provided, it is updated as each item is aligned.
+	'''
+	metrics = metrics if metrics is not None else Metrics()
+	if args.pipeline:
+		run_pipeline(
+			args=args, 
+			gentle_url=gentle_url, 
+			gentle_params=gentle_params, 
+			gentle_pool=gentle_pool, 
+			cache=cache, 
+			audio_cache=audio_cache, 
+			metrics=metrics, 
+			progress=progress
+		)
+		return
+	
+	for transcription_file, sound_dir, stimuli_file in zip(args.transcription_files, args.sound_dirs, args.stimuli_files):
+		if progress is not None:
+			progress.set_postfix_str(os.path.basename(transcription_file))
+		
+		# Keep the transcriptions in memory and send them to gentle directly
+		with metrics.time('read_transcriptions'):
+			transcriptions = get_transcriptions(
 				transcription_file=transcription_file, 
-				output_dir=sound_dir
+				item_col=args.item, 
+				transcription_col=args.transcription
+			)
+		
+		align_dir = save_alignments(
+			sound_dir=sound_dir, 
+			text_dir=None, 
+			transcription_file=transcription_file, 
+			gentle_url=gentle_url, 
+			gentle_params=gentle_params,
+			jobs=args.jobs,
+			gentle_pool=gentle_pool,
+			cache=cache,
+			resume=args.resume,
+			batch=args.batch,
+			audio_cache=audio_cache,
+			transcriptions=transcriptions,
+			on_aligned=(lambda grid: progress.update()) if progress is not None else None,
+			on_failed=(lambda grid: progress.update()) if progress is not None else None,
+			sound_index=args.sound_dir_indexes.get(sound_dir),
+			metrics=metrics,
+			timeout=args.timeout,
+			timeout_factor=args.timeout_factor,
+			retries=args.retries,
+			hedge=not args.no_hedge,
+			split=args.split,
+			split_silence=args.split_silence
+		)
+		
+		save_results(
+			align_dir=align_dir,
+			sound_dir=sound_dir,
+			transcription_file=transcription_file,
+			stimuli_file=stimuli_file,
+			item_col=args.item,
+			max_words=args.max_words,
+			output_format=args.output_format,
+			extract_jobs=args.extract_jobs,
+			metrics=metrics
+		)
+
+def align_text_to_audio() -> None:
+	'''
+	Main function. Handles aligning text to audio
+	and writing out results.
+	'''
+	args = parse_arguments()
+	url = f'http://localhost:{args.port}/transcriptions'
+	params = {'async' : 'true' if args.batch else 'false'}
+	cache = (
+		AlignmentCache(args.cache_dir, max_size=args.cache_size * 1024 * 1024, validate=parse_alignment) 
+		if not args.no_cache else None
+	)
+	audio_cache = (
+		AlignmentCache(os.path.join(args.cache_dir, 'audio'), max_size=args.cache_size * 1024 * 1024, extension='mp3') 
+		if args.precondition else None
+	)
+	metrics = Metrics()
+	try:
+		with GentleListener(
+			port=args.port, 
+			docker_location=args.docker_location, 
+			wait=args.wait,
+			instances=args.instances,
+			gentle_command=args.gentle_command,
+			keep_alive=args.keep_alive,
+			metrics=metrics
+		) as gentle_pool, tqdm(
+			# each transcription file has (at most) one item for each mp3 in its sound directory
+			total=sum(len(args.sound_dir_indexes[sound_dir].files('.mp3')) for sound_dir in args.sound_dirs),
+			unit='item'
+		) as progress:
+			align_files(
+				args=args, 
+				gentle_url=url, 
+				gentle_params=params, 
+				gentle_pool=gentle_pool, 
+				cache=cache, 
+				audio_cache=audio_cache, 
+				metrics=metrics, 
+				progress=progress
 			)
+	finally:
+		if args.metrics:
+			json_file, prom_file = metrics.save(args.metrics)
+			log.info(f'Metrics saved to {json_file!r} and {prom_file!r}.')
 
 if __name__ == '__main__':
 	align_text_to_audio()
@@ -0,0 +1,486 @@
+# align_queue.py by Michael Wilson
+# Lets several machines share the work of aligning with align.py through a job queue kept in a SQLite file
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+
+import requests
+import pandas as pd
+
+from typing import *
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import align
+
+log = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(
+	description=(
+		'Shares aligning with gentle between several machines. The items to align are added to a queue '
+		'file (init), workers on each machine lease items from it and align them with their own gentle '
+		'(work), and the TextGrids and durations are saved once everything has been aligned (merge).'
+	)
+)
+subparsers = parser.add_subparsers(dest='command', required=True)
+
+init_parser = subparsers.add_parser('init', help='Adds the items in one or more transcription files to the queue.')
+init_parser.add_argument(
+	'queue',
+	help='Required argument to provide the path to the queue file. It is created if it does not exist.'
+)
+init_parser.add_argument(
+	'align_args', nargs=argparse.REMAINDER,
+	help=(
+		"align.py's arguments: the transcription files, and optionally the sound directories, stimuli "
+		"files, and -t, -i, -m, and -f. These are used the same way as by align.py."
+	)
+)
+
+work_parser = subparsers.add_parser('work', help='Aligns items from the queue with gentle until there are none left.')
+work_parser.add_argument(
+	'queue',
+	help='Required argument to provide the path to the queue file.'
+)
+work_parser.add_argument(
+	'-p', '--port', default=align.parser.get_default('port'), type=int,
+	help="Optional argument to specify the port to run this worker's gentle on, as in align.py. Default is 8765."
+)
+work_parser.add_argument(
+	'-d', '--docker_location', default=align.parser.get_default('docker_location'), type=str,
+	help='Optional argument to specify where Docker is on Windows, as in align.py.'
+)
+work_parser.add_argument(
+	'-w', '--wait', default=align.parser.get_default('wait'), type=int,
+	help='Optional argument to specify how long to wait for Docker to start on Windows, as in align.py. Default is 75.'
+)
+work_parser.add_argument(
+	'-j', '--jobs', default=1, type=int,
+	help='Optional argument to specify how many items this worker leases and sends to gentle at once. Default is 1.'
+)
+work_parser.add_argument(
+	'-n', '--instances', default=1, type=int,
+	help='Optional argument to specify how many gentle instances this worker uses, as in align.py. Default is 1.'
+)
+work_parser.add_argument(
+	'-c', '--gentle_command', default=align.parser.get_default('gentle_command'), type=str,
+	help='Optional argument to specify the command used to start gentle on Linux, as in align.py.'
+)
+work_parser.add_argument(
+	'-k', '--keep_alive', default=False, action='store_true',
+	help='Optional argument to leave the gentle instances this worker started running when it finishes.'
+)
+work_parser.add_argument(
+	'--timeout', default=align.parser.get_default('timeout'), type=float,
+	help='Optional argument to specify how long to wait for gentle to align an item in seconds, as in align.py. Default is 60.'
+)
+work_parser.add_argument(
+	'--timeout_factor', default=align.parser.get_default('timeout_factor'), type=float,
+	help='Optional argument to specify how many seconds to add to --timeout per second of audio, as in align.py. Default is 5.'
+)
+work_parser.add_argument(
+	'--retries', default=align.parser.get_default('retries'), type=int,
+	help='Optional argument to specify how many more times to send an item to gentle if it fails, as in align.py. Default is 2.'
+)
+work_parser.add_argument(
+	'--no_hedge', default=False, action='store_true',
+	help='Optional argument to not send a duplicate of slow requests to a second gentle instance, as in align.py.'
+)
+work_parser.add_argument(
+	'-l', '--lease', default=600, type=float,
+	help=(
+		'Optional argument to specify how long (in seconds) a worker has to align an item before it '
+		'is given to another worker. Default is 600.'
+	)
+)
+work_parser.add_argument(
+	'--max_attempts', default=3, type=int,
+	help='Optional argument to specify how many times to try to align an item before giving up on it. Default is 3.'
+)
+work_parser.add_argument(
+	'--poll', default=5, type=float,
+	help=(
+		'Optional argument to specify how often (in seconds) to check for items whose lease has run out, '
+		'while other workers are aligning the last items. Default is 5.'
+	)
+)
+
+status_parser = subparsers.add_parser('status', help='Shows how many items in the queue are in each state.')
+status_parser.add_argument(
+	'queue',
+	help='Required argument to provide the path to the queue file.'
+)
+
+merge_parser = subparsers.add_parser('merge', help='Saves TextGrids and durations once every item has been aligned.')
+merge_parser.add_argument(
+	'queue',
+	help='Required argument to provide the path to the queue file.'
+)
+merge_parser.add_argument(
+	'-e', '--extract_jobs', default=1, type=int,
+	help='Optional argument to specify how many processes to save TextGrids with. Default is 1.'
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (
+	name TEXT PRIMARY KEY,
+	value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	transcription_file TEXT UNIQUE,
+	sound_dir TEXT,
+	stimuli_file TEXT
+);
+CREATE TABLE IF NOT EXISTS units (
+	id INTEGER PRIMARY KEY,
+	file_id INTEGER REFERENCES files(id),
+	item TEXT,
+	audio_file TEXT,
+	transcript BLOB,
+	status TEXT DEFAULT 'pending',
+	worker TEXT,
+	lease_expires REAL,
+	attempts INTEGER DEFAULT 0,
+	result BLOB,
+	UNIQUE(file_id, item)
+);
+CREATE INDEX IF NOT EXISTS units_status ON units(status);
+'''
+
+class AlignmentQueue():
+	'''
+	A queue of items to align, kept in a SQLite file that every worker can reach.
+	Each item is pending, leased (being aligned by a worker), done, or failed.
+	Leased items whose lease runs out before they are done (e.g., because a worker crashed) are leased again.
+	The queue is safe to use from several threads, processes, and machines at once.
+	'''
+	def __init__(self, path: str, timeout: float = 60.):
+		self.path = path
+		self.lock = threading.Lock()
+		
+		# we manage transactions ourselves, so that leasing can lock the queue before reading it
+		self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+		self.connection.row_factory = sqlite3.Row
+		self.connection.executescript(SCHEMA)
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, tb):
+		self.connection.close()
+	
+	@contextmanager
+	def transaction(self):
+		'''Runs the with block in a transaction that keeps anyone else from writing to the queue.'''
+		with self.lock:
+			self.connection.execute('BEGIN IMMEDIATE')
+			try:
+				yield self.connection
+			except BaseException:
+				self.connection.execute('ROLLBACK')
+				raise
+			
+			self.connection.execute('COMMIT')
+	
+	def set_settings(self, settings: Dict) -> None:
+		'''Saves settings (like align.py's arguments) that are needed to merge the results.'''
+		with self.transaction() as connection:
+			connection.executemany(
+				'INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)',
+				[(name, json.dumps(value)) for name, value in settings.items()]
+			)
+	
+	def get_settings(self) -> Dict:
+		'''Gets the saved settings.'''
+		with self.lock:
+			return {row['name']: json.loads(row['value']) for row in self.connection.execute('SELECT * FROM settings')}
+	
+	def add_file(
+		self,
+		transcription_file: str,
+		sound_dir: str,
+		stimuli_file: str,
+		units: Dict[str,Tuple[str,bytes]]
+	) -> int:
+		'''
+		Adds a transcription file's items to the queue. units maps each item to its audio file and transcription.
+		Items that are already in the queue are left as they are. Returns the number of items added.
+		'''
+		with self.transaction() as connection:
+			connection.execute(
+				'INSERT OR IGNORE INTO files (transcription_file, sound_dir, stimuli_file) VALUES (?, ?, ?)',
+				(transcription_file, sound_dir, stimuli_file)
+			)
+			file_id = connection.execute(
+				'SELECT id FROM files WHERE transcription_file = ?', (transcription_file,)
+			).fetchone()['id']
+			
+			before = connection.total_changes
+			connection.executemany(
+				'INSERT OR IGNORE INTO units (file_id, item, audio_file, transcript) VALUES (?, ?, ?, ?)',
+				[(file_id, item, audio_file, transcript) for item, (audio_file, transcript) in units.items()]
+			)
+			return connection.total_changes - before
+	
+	def lease(self, worker: str, n: int = 1, duration: float = 600., max_attempts: int = 3) -> List[sqlite3.Row]:
+		'''
+		Leases up to n items to a worker for duration seconds, including items whose lease has run out.
+		Items that have already been leased max_attempts times are marked as failed instead.
+		'''
+		now = time.time()
+		with self.transaction() as connection:
+			connection.execute(
+				"UPDATE units SET status = 'failed', lease_expires = NULL "
+				"WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts >= ?",
+				(now, max_attempts)
+			)
+			units = connection.execute(
+				'SELECT units.id, units.item, units.audio_file, units.transcript, files.transcription_file '
+				'FROM units JOIN files ON units.file_id = files.id '
+				"WHERE units.status = 'pending' OR (units.status = 'leased' AND units.lease_expires < ?) "
+				'ORDER BY units.id LIMIT ?',
+				(now, n)
+			).fetchall()
+			connection.executemany(
+				"UPDATE units SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+				[(worker, now + duration, unit['id']) for unit in units]
+			)
+		
+		return units
+	
+	def complete(self, unit_id: int, worker: str, result: bytes, ok: bool = True) -> None:
+		'''
+		Saves gentle's response for an item. If gentle wasn't able to align it (ok is False),
+		it is marked as failed, and the response is saved to describe the error.
+		'''
+		with self.transaction() as connection:
+			connection.execute(
+				"UPDATE units SET status = ?, worker = ?, lease_expires = NULL, result = ? WHERE id = ? AND status != 'done'",
+				('done' if ok else 'failed', worker, result, unit_id)
+			)
+	
+	def release(self, unit_id: int, worker: str, attempted: bool = True) -> None:
+		'''
+		Gives up a worker's lease on an item, so that it can be leased again. If attempted is False 
+		(e.g., because the worker's gentle couldn't be reached), the lease doesn't count toward max_attempts.
+		'''
+		with self.transaction() as connection:
+			connection.execute(
+				"UPDATE units SET status = 'pending', lease_expires = NULL, attempts = attempts - ? "
+				"WHERE id = ? AND worker = ? AND status = 'leased'",
+				(0 if attempted else 1, unit_id, worker)
+			)
+	
+	def counts(self) -> Dict[str,Dict[str,int]]:
+		'''Gets how many items there are in each state for each transcription file.'''
+		counts = {}
+		with self.lock:
+			for row in self.connection.execute(
+				'SELECT files.transcription_file, units.status, COUNT(*) AS n '
+				'FROM units JOIN files ON units.file_id = files.id GROUP BY files.id, units.status'
+			):
+				counts.setdefault(row['transcription_file'], {})[row['status']] = row['n']
+		
+		return counts
+	
+	def files(self) -> List[sqlite3.Row]:
+		'''Gets the transcription files in the queue, with their sound directories and stimuli files.'''
+		with self.lock:
+			return self.connection.execute('SELECT * FROM files ORDER BY id').fetchall()
+	
+	def results(self, file_id: int) -> Iterator[sqlite3.Row]:
+		'''Yields the item, audio file, status, and gentle's response (or None if there is none) for each item of a transcription file.'''
+		with self.lock:
+			rows = self.connection.execute(
+				'SELECT item, audio_file, status, result FROM units WHERE file_id = ? ORDER BY id', (file_id,)
+			).fetchall()
+		
+		yield from rows
+
+def init(args: argparse.Namespace) -> None:
+	'''Adds the items in the transcription files to the queue.'''
+	align_args = align.parse_arguments(args.align_args)
+	with AlignmentQueue(args.queue) as queue:
+		queue.set_settings({
+			'item': align_args.item,
+			'transcription': align_args.transcription,
+			'max_words': align_args.max_words,
+			'output_format': align_args.output_format,
+		})
+		
+		for transcription_file, sound_dir, stimuli_file in zip(
+			align_args.transcription_files,
+			align_args.sound_dirs,
+			align_args.stimuli_files
+		):
+			transcriptions = align.get_transcriptions(
+				transcription_file=transcription_file,
+				item_col=align_args.item,
+				transcription_col=align_args.transcription
+			)
+			audio_items = align.get_mp3_to_transcript_mapping(
+				sound_dir=sound_dir,
+				transcriptions=transcriptions,
+				transcription_file=transcription_file,
+				sound_index=align_args.sound_dir_indexes[sound_dir]
+			)
+			
+			# workers may be started from other directories
+			added = queue.add_file(
+				transcription_file=os.path.abspath(transcription_file),
+				sound_dir=os.path.abspath(sound_dir),
+				stimuli_file=os.path.abspath(stimuli_file),
+				units={
+					item: (os.path.abspath(os.path.join(sound_dir, audio_name)), transcriptions[item])
+					for audio_name, item in audio_items.items()
+				}
+			)
+			log.info(f'Added {added} items from {transcription_file!r} to the queue.')
+
+def work(args: argparse.Namespace) -> None:
+	'''Leases items from the queue and aligns them with gentle until there are none left.'''
+	worker = f'{socket.gethostname()}:{os.getpid()}'
+	gentle_params = {'async': 'false'}
+	
+	with AlignmentQueue(args.queue) as queue, align.GentleListener(
+		port=args.port,
+		docker_location=args.docker_location,
+		wait=args.wait,
+		instances=args.instances,
+		gentle_command=args.gentle_command,
+		keep_alive=args.keep_alive
+	) as gentle_pool, requests.Session() as session, ThreadPoolExecutor(max_workers=args.jobs) as executor:
+		adapter = requests.adapters.HTTPAdapter(
+			pool_connections=len(gentle_pool.urls), 
+			pool_maxsize=args.jobs * (1 if args.no_hedge else 2)
+		)
+		session.mount('http://', adapter)
+		
+		def align_unit(unit: sqlite3.Row) -> None:
+			try:
+				with open(unit['audio_file'], 'rb') as audio_mp3:
+					audio = audio_mp3.read()
+				
+				r = align.post_alignment(
+					session=session,
+					gentle_pool=gentle_pool,
+					gentle_params=gentle_params,
+					audio_file=unit['audio_file'],
+					audio=audio,
+					text_file=f'{unit["item"]}.txt',
+					transcript=unit['transcript'],
+					timeout=align.get_deadline(audio, timeout=args.timeout, timeout_factor=args.timeout_factor),
+					retries=args.retries,
+					hedge=not args.no_hedge
+				)
+			except Exception as e:
+				log.warning(f'Unable to align item {unit["item"]!r} from {unit["transcription_file"]!r}: {e}')
+				
+				# it's not the item's fault if this worker's gentle can't be reached
+				queue.release(unit['id'], worker, attempted=not isinstance(e, requests.exceptions.ConnectionError))
+				return
+			
+			queue.complete(unit['id'], worker, r.content, ok=r.ok)
+		
+		aligned = 0
+		while True:
+			units = queue.lease(worker, n=args.jobs, duration=args.lease, max_attempts=args.max_attempts)
+			if not units:
+				# other workers may still be aligning items, and if they don't finish them we'll need to
+				if not any(
+					counts.get('pending') or counts.get('leased')
+					for counts in queue.counts().values()
+				):
+					break
+				
+				time.sleep(args.poll)
+				continue
+			
+			list(executor.map(align_unit, units))
+			aligned += len(units)
+			
+			# leave the rest of the items to other workers if this one's gentle has stopped answering
+			if not gentle_pool.is_alive():
+				log.error(f'{worker} is unable to reach its gentle. Stopping after working on {aligned} items.')
+				sys.exit(1)
+		
+		log.info(f'No items left to align. {worker} worked on {aligned} items.')
+
+def status(args: argparse.Namespace) -> None:
+	'''Shows how many items in the queue are in each state.'''
+	with AlignmentQueue(args.queue) as queue:
+		for transcription_file, counts in queue.counts().items():
+			print(f'{transcription_file}: ' + ', '.join(f'{n} {state}' for state, n in sorted(counts.items())))
+
+def merge(args: argparse.Namespace) -> None:
+	'''Saves the alignments from the queue to each sound directory, and saves the TextGrids and durations.'''
+	with AlignmentQueue(args.queue) as queue:
+		unfinished = sum(
+			counts.get('pending', 0) + counts.get('leased', 0)
+			for counts in queue.counts().values()
+		)
+		if unfinished:
+			log.error(f'{unfinished} items have not been aligned yet. Run more workers or wait for them to finish.')
+			sys.exit(1)
+		
+		settings = queue.get_settings()
+		for file in queue.files():
+			align_dir = align.make_new_dir(prefix=os.path.join(file['sound_dir'], 'gentle_align'), suffix='')
+			failures = []
+			store = align.WordStore()
+			for unit in queue.results(file['id']):
+				# like align.py, list the items that could not be aligned instead of saving gentle's error
+				if unit['status'] != 'done':
+					failures.append({
+						'item': unit['item'], 
+						'audio': os.path.basename(unit['audio_file']), 
+						'error': (
+							unit['result'].decode('utf-8', errors='replace').strip()[:200] if unit['result'] 
+							else 'gentle did not respond'
+						),
+					})
+					continue
+				
+				with open(os.path.join(align_dir, f'{unit["item"]}.json'), 'wb') as out_file:
+					out_file.write(unit['result'])
+				
+				store.append(unit['item'], align.parse_json(unit['result']))
+			
+			store.save(os.path.join(align_dir, 'words'))
+			
+			if failures:
+				report = os.path.join(align_dir, 'failures.csv')
+				pd.DataFrame(failures).to_csv(report, index=False)
+				log.warning(f'{len(failures)} item(s) from {file["transcription_file"]!r} could not be aligned. See {report!r}.')
+			
+			align.save_results(
+				align_dir=align_dir,
+				sound_dir=file['sound_dir'],
+				transcription_file=file['transcription_file'],
+				stimuli_file=file['stimuli_file'],
+				item_col=settings['item'],
+				max_words=settings['max_words'],
+				output_format=settings['output_format'],
+				extract_jobs=args.extract_jobs
+			)
+			log.info(f'Saved results for {file["transcription_file"]!r} to {file["sound_dir"]!r}.')
+
+def align_queue() -> None:
+	'''Main function. Runs the command given on the command line.'''
+	args = parser.parse_args()
+	for name in ['jobs', 'extract_jobs', 'max_attempts']:
+		if getattr(args, name, 1) < 1:
+			log.error(f'--{name} must be at least 1 (got {getattr(args, name)}).')
+			sys.exit(1)
+	
+	{'init': init, 'work': work, 'status': status, 'merge': merge}[args.command](args)
+
+if __name__ == '__main__':
+	align_queue()
@@ -0,0 +1,240 @@
+# benchmark.py by Michael Wilson
+# Measures how long each step of align.py takes using synthetic data and gentle_standin.py
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+
+import pandas as pd
+
+from typing import *
+from contextlib import contextmanager
+
+import align
+
+log = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(
+	description=(
+		'Benchmarks align.py against gentle_standin.py with synthetic sound directories and '
+		'transcription files, and reports items/sec, time, and peak memory for each step.'
+	)
+)
+parser.add_argument(
+	'-s', '--sizes', default='10:1000:10000', type=str,
+	help="Optional argument to specify the numbers of items to benchmark, separated by ':'. Default is '10:1000:10000'."
+)
+parser.add_argument(
+	'-p', '--port', default=8799, type=int,
+	help='Optional argument to specify the port to run gentle_standin.py on. Default is 8799.'
+)
+parser.add_argument(
+	'-l', '--latency', default=0., type=float,
+	help='Optional argument to specify how long each alignment takes the stand-in in seconds. Default is 0.'
+)
+parser.add_argument(
+	'--jitter', default=0., type=float,
+	help='Optional argument to specify the random extra time added to each alignment by the stand-in in seconds. Default is 0.'
+)
+parser.add_argument(
+	'-j', '--jobs', default=1, type=int,
+	help='Optional argument to specify how many alignments to send at once (align.py --jobs). Default is 1.'
+)
+parser.add_argument(
+	'-e', '--extract_jobs', default=1, type=int,
+	help='Optional argument to specify how many processes to extract durations with (align.py --extract_jobs). Default is 1.'
+)
+parser.add_argument(
+	'-b', '--audio_bytes', default=4096, type=int,
+	help='Optional argument to specify the size of each synthetic mp3 in bytes. Default is 4096.'
+)
+parser.add_argument(
+	'-o', '--output', default='', type=str,
+	help='Optional argument to specify a file to save the results to as JSON.'
+)
+parser.add_argument(
+	'--no_memory', default=False, action='store_true',
+	help='Optional argument to skip measuring peak memory, which makes each step run faster.'
+)
+
+VOCABULARY = [
+	'the', 'a', 'cat', 'dog', 'student', 'teacher', 'saw', 'thought', 'that', 'believed',
+	'quickly', 'yesterday', 'horse', 'raced', 'past', 'barn', 'fell', 'old', 'man', 'boat',
+]
+
+def make_data(directory: str, n_items: int, audio_bytes: int = 4096, seed: int = 0) -> Tuple[str,str]:
+	'''
+	Makes a sound directory with n_items synthetic mp3s and a matching transcription file.
+	Returns the path to the transcription file and the sound directory.
+	'''
+	rng = random.Random(seed)
+	sound_dir = os.path.join(directory, f'items_{n_items}')
+	os.makedirs(sound_dir)
+	for item in range(1, n_items + 1):
+		with open(os.path.join(sound_dir, f'{item}.mp3'), 'wb') as out_file:
+			out_file.write(rng.randbytes(audio_bytes))
+	
+	transcription_file = os.path.join(sound_dir, f'items_{n_items}.csv')
+	pd.DataFrame({
+		'Item': range(1, n_items + 1),
+		'transcription': [
+			' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, 15))).capitalize() + '.'
+			for _ in range(n_items)
+		],
+	}).to_csv(transcription_file, index=False)
+	
+	return transcription_file, sound_dir
+
+@contextmanager
+def measure(results: Dict, stage: str, n_items: int, memory: bool = True):
+	'''Records the time, items per second, and peak traced memory of the code run in the with block.'''
+	if memory:
+		tracemalloc.start()
+	
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		seconds = time.perf_counter() - start
+		peak = tracemalloc.get_traced_memory()[1] if memory else None
+		if memory:
+			tracemalloc.stop()
+		
+		results[stage] = {
+			'seconds': seconds,
+			'items_per_sec': n_items / seconds if seconds else float('inf'),
+			'peak_mb': peak / 1024 / 1024 if peak is not None else None,
+		}
+
+def run_benchmark(
+	directory: str,
+	n_items: int,
+	gentle_url: str,
+	port: int,
+	jobs: int = 1,
+	extract_jobs: int = 1,
+	audio_bytes: int = 4096,
+	memory: bool = True
+) -> Dict[str,Dict[str,float]]:
+	'''Runs each step of align.py on n_items synthetic items, and then the whole thing end to end.'''
+	results = {}
+	transcription_file, sound_dir = make_data(directory, n_items=n_items, audio_bytes=audio_bytes)
+	
+	with measure(results, 'get_transcriptions', n_items, memory):
+		transcriptions = align.get_transcriptions(
+			transcription_file=transcription_file,
+			item_col='Item',
+			transcription_col='transcription'
+		)
+	
+	with measure(results, 'save_alignments', n_items, memory):
+		align_dir = align.save_alignments(
+			sound_dir=sound_dir,
+			text_dir=None,
+			transcription_file=transcription_file,
+			gentle_url=gentle_url,
+			gentle_params={'async': 'false'},
+			jobs=jobs,
+			transcriptions=transcriptions
+		)
+	
+	grids = align.sort_human([file for file in os.listdir(align_dir) if file.endswith('.json')])
+	grids = [os.path.join(align_dir, grid) for grid in grids]
+	columns = align.get_duration_columns(item_col='Item', max_words=20)
+	with measure(results, 'save_json_as_textgrid', n_items, memory):
+		rows = align.save_jsons_as_textgrids(
+			files=grids,
+			jobs=extract_jobs,
+			output_dir=sound_dir,
+			return_pd_series=True,
+			pd_colnames=columns
+		)
+	
+	with measure(results, 'save_durations', n_items, memory):
+		durations = align.DurationTable(columns=columns, size=len(rows))
+		for row in rows:
+			durations.append(row)
+		
+		align.save_durations(
+			durations=durations.to_frame(),
+			stimuli_file=transcription_file,
+			item_col='Item',
+			transcription_file=transcription_file,
+			output_dir=sound_dir
+		)
+	
+	# run the whole thing again from scratch, as from the command line
+	shutil.rmtree(sound_dir)
+	transcription_file, sound_dir = make_data(directory, n_items=n_items, audio_bytes=audio_bytes)
+	argv = sys.argv
+	sys.argv = [
+		'align.py', transcription_file, sound_dir,
+		'--port', str(port), '--jobs', str(jobs), '--extract_jobs', str(extract_jobs), '--no_cache',
+	]
+	try:
+		with measure(results, 'align_text_to_audio', n_items, memory):
+			align.align_text_to_audio()
+	finally:
+		sys.argv = argv
+	
+	shutil.rmtree(sound_dir)
+	return results
+
+def print_results(n_items: int, results: Dict[str,Dict[str,float]]) -> None:
+	'''Prints the results for one size as a table.'''
+	print(f'\n{n_items} items')
+	print(f'{"step":<24}{"seconds":>12}{"items/sec":>14}{"peak MB":>12}')
+	for stage, result in results.items():
+		peak = f'{result["peak_mb"]:.1f}' if result['peak_mb'] is not None else '-'
+		print(f'{stage:<24}{result["seconds"]:>12.3f}{result["items_per_sec"]:>14.1f}{peak:>12}')
+
+def benchmark() -> None:
+	'''Main function. Starts the stand-in gentle and runs the benchmarks for each size.'''
+	args = parser.parse_args()
+	sizes = [int(size) for size in args.sizes.split(':')]
+	
+	# Run the stand-in in its own process so it doesn't compete with align.py for the GIL
+	standin = subprocess.Popen([
+		sys.executable, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'gentle_standin.py'),
+		'--port', str(args.port), '--latency', str(args.latency), '--jitter', str(args.jitter), '--seed', '0',
+	])
+	try:
+		if not align.poll(lambda: align.is_gentle_ready(args.port), timeout=30):
+			log.error(f'gentle_standin.py did not start on port {args.port}.')
+			sys.exit(1)
+		
+		all_results = {}
+		for n_items in sizes:
+			with tempfile.TemporaryDirectory() as directory:
+				all_results[n_items] = run_benchmark(
+					directory=directory,
+					n_items=n_items,
+					gentle_url=f'http://localhost:{args.port}/transcriptions',
+					port=args.port,
+					jobs=args.jobs,
+					extract_jobs=args.extract_jobs,
+					audio_bytes=args.audio_bytes,
+					memory=not args.no_memory
+				)
+			
+			print_results(n_items, all_results[n_items])
+		
+		if args.output:
+			with open(args.output, 'wt') as out_file:
+				json.dump({
+					'settings': {k: v for k, v in vars(args).items() if k != 'output'},
+					'results': all_results
+				}, out_file, indent=1)
+	finally:
+		standin.terminate()
+		standin.wait()
+
+if __name__ == '__main__':
+	benchmark()
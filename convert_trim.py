@@ -1,12 +1,18 @@
+import io
 import glob
 import re
+import hashlib
 import argparse
 import os
 import zipfile
 import sys
+import subprocess
 import pandas as pd
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 #import requests
 from pydub import AudioSegment
+from pydub.utils import mediainfo, mediainfo_json
 
 parser = argparse.ArgumentParser()
 parser.add_argument('directories', nargs = '?', default = os.path.dirname(os.path.realpath(__file__)),
@@ -21,200 +27,421 @@ parser.add_argument('--convert_only', '-co', default = False, action = 'store_tr
 	help = 'Optional argument to convert to mp3 only (and not trim).')
 parser.add_argument('--no_groups', '-ng', default = False, action = 'store_true',
 	help = 'Optional argument to not automatically get groups. Getting groups has only been tested for experiencer and garden-path items.')
+parser.add_argument('--jobs', '-j', default = 1, type = int,
+	help = 'Optional argument to specify how many files to unzip and convert at once. Default is 1.')
+parser.add_argument('--no_cache', '-nc', default = False, action = 'store_true',
+	help = 'Optional argument to not save or use the parsed results file and transcription templates.')
+parser.add_argument('--from_zip', '-fz', default = False, action = 'store_true',
+	help = 'Optional argument to convert the webm files in zip files without extracting them first.')
 #parser.add_argument('--auto_transcribe', '-at', default = False, action = 'store_true',
 #	help = 'Optional argument to auto_transcribe the files we\'re converting.')
 #parser.add_argument('--groups_list', '-g', default = '',
 #	help = 'Optional argument containing a list of groups to use to generate transcription templates (if you are not getting them automatically from the zip files).')
 
-args = parser.parse_args()
+def map_jobs(function, items, jobs = 1):
+	'''Calls function on each item, using a pool of jobs processes if jobs > 1. Yields the results in order.'''
+	if jobs == 1:
+		yield from map(function, items)
+	else:
+		with ProcessPoolExecutor(max_workers = jobs) as executor:
+			yield from executor.map(function, items)
+
+def remove_file(f):
+	'''Deletes a file, retrying until whatever has it open lets go of it.'''
+	success = False
+	while not success:
+		try:
+			os.remove(f)
+			success = True
+		except:
+			pass
+
+def extract_zip(file, dont_delete = False):
+	'''Extracts a zip file into the directory containing it, and deletes it unless dont_delete.'''
+	with zipfile.ZipFile(file, 'r') as f:
+		f.extractall(os.path.split(file)[0])
+
+	if not dont_delete:
+		os.remove(file)
+
+	return file
+
+def get_trim_start(num, duration):
+	'''Returns how many ms to trim from the start of a recording of item num that is duration ms long.'''
+	# Only trim if the sound is long enough
+	if duration <= 10000:
+		return 0
+
+	# If item number is 1, 4, 7, etc. then there are two nonce words (+100 ms buffer)
+	if num % 3 == 1:
+		return 4100
+
+	# If item number is 2, 5, 8, etc. then there are three nonce words (+50 ms buffer)
+	if num % 3 == 2:
+		return 6050
+
+	# If item number is 3, 6, 9, etc. then there are four nonce words (no buffer)
+	return 8000
+
+def get_duration(f, data = None):
+	'''
+	Returns the duration of a sound file in ms by probing it. If it isn't listed in the file (as in most
+	webm files recorded in a browser), it is read from the timestamp of the last packet instead.
+	Returns None if neither works. If data is given, it is probed instead of reading f.
+	'''
+	try:
+		if data is not None:
+			return float(mediainfo_json(io.BytesIO(data))['format']['duration']) * 1000
+		
+		return float(mediainfo(f)['duration']) * 1000
+	except (KeyError, ValueError, OSError):
+		return get_last_packet_time(f, data = data)
+
+def get_last_packet_time(f, data = None):
+	'''
+	Returns the timestamp of the end of the last audio packet in a sound file in ms, or None if it can't be read.
+	ffmpeg copies the packets to nowhere without decoding them, so the recording is never decoded into memory.
+	If data is given, it is piped to ffmpeg instead of reading f.
+	'''
+	try:
+		progress = subprocess.run(
+			[AudioSegment.converter, '-v', 'error', '-nostats', '-i', f if data is None else 'pipe:0', '-map', '0:a:0', '-c', 'copy', '-f', 'null', '-progress', 'pipe:1', '-'],
+			input = data, capture_output = True, check = True
+		).stdout.decode(errors = 'replace')
+	except (subprocess.CalledProcessError, OSError):
+		return None
+	
+	times = re.findall(r'^out_time_us=(\d+)$', progress, flags = re.MULTILINE)
+	return int(times[-1]) / 1000 if times else None
+
+def stream_to_mp3(f, out_file, start = 0, data = None):
+	'''
+	Converts a sound file to mp3 starting start ms in. ffmpeg seeks to the start and streams the
+	rest straight to the mp3, so the recording is never decoded into memory.
+	If data is given, it is piped to ffmpeg instead of reading f.
+	'''
+	try:
+		subprocess.run(
+			[AudioSegment.converter, '-y', '-loglevel', 'error', '-ss', str(start / 1000), '-i', f if data is None else 'pipe:0', '-vn', '-f', 'mp3', out_file],
+			input = data, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, check = True
+		)
+	except subprocess.CalledProcessError as e:
+		# Don't leave a partial mp3 behind
+		if os.path.isfile(out_file):
+			os.remove(out_file)
+		
+		raise RuntimeError(f'Unable to convert {f}: {e.stderr.decode(errors = "replace").strip()}')
 
-# Figure out the sound directories
-#if args.auto_transcribe:
-#	auto_transcribe_directories = args.directories
+def convert_file(f, convert_only = False, dont_delete = False, data = None):
+	'''
+	Converts a webm file to mp3, trimming it based on its item number unless convert_only.
+	The webm file is only deleted once the mp3 has been exported, and not at all if dont_delete.
+	If data is given, it is used as the contents of the webm file, which then doesn't need to exist.
+	'''
+	directory = f'{os.path.split(f)[0]}/'
 
-args.directories = args.directories.split(':')
+	# Trim if we're doing that
+	if not convert_only:
 
-# Allow for wildcards
-args.directories = [item for sublist in [glob.glob(directory) for directory in args.directories] for item in sublist]
+		# Find the stimulus number
+		num = int(re.search(r'^[1-9][0-9]?', os.path.split(f)[1]).group())
+		
+		# Get the length without decoding, and seek past the trimmed part while converting
+		duration = get_duration(f, data = data)
+		if duration is None:
+			raise RuntimeError(f'Unable to get the duration of {f}')
+		
+		stream_to_mp3(f, directory + str(num) + "_trimmed.mp3", start = get_trim_start(num, duration), data = data)
+	# Otherwise, just convert the audio
+	else:
+		stream_to_mp3(f, directory + os.path.splitext(os.path.basename(f))[0] + '.mp3', data = data)
+
+	if not dont_delete and data is None:
+		remove_file(f)
+
+	return f
+
+def convert_zip_member(member, convert_only = False):
+	'''
+	Converts a webm file in a zip file without extracting it, saving the mp3 to the directory containing the zip file.
+	member is a tuple of the zip file and the name of the webm file in it.
+	'''
+	file, name = member
+	with zipfile.ZipFile(file, 'r') as f:
+		data = f.read(name)
+
+	return convert_file(f'{os.path.split(file)[0]}/{name}', convert_only = convert_only, data = data)
+
+RESULTS_COLUMNS = ['time_rec', 'IP', 'controller', 'item_id', 'element', 'type', 'sub_experiment', 
+				   'element_type', 'element_name', 'parameter', 'value', 'event_time', 'category', 
+				   'group', 'item', 'sentence_type', 'relatedness', 'sentence', 'martrix_verb', 
+				   'prob1', 'prob2', 'prob3', 'prob4', 'wait1', 'wait2', 'wait3', 'wait4', 'comments']
+
+RESULTS_DTYPES = {'IP': 'category', 'value': str, 'category': 'category', 'group': 'category'}
+
+def read_results(results_file):
+	'''Reads the columns of a PCIbex results file needed to get subjects' groups.'''
+	return pd.read_csv(results_file, comment = '#', names = RESULTS_COLUMNS,
+		usecols = list(RESULTS_DTYPES), dtype = RESULTS_DTYPES)
+
+def load_results(results_file, cache_file = None):
+	'''
+	Reads a PCIbex results file, only parsing what has been added to it since the last time it was read.
+	The parsed results are saved to cache_file (by default, results_file + '.cache.pkl') along with how many
+	bytes of the results file they came from and a checksum of those bytes. If those bytes have changed
+	since then, the results file was rewritten instead of added to, so the whole thing is parsed again.
+	'''
+	cache_file = cache_file or f'{results_file}.cache.pkl'
+	try:
+		cache = pd.read_pickle(cache_file)
+	except Exception:
+		cache = {'offset': 0, 'checksum': None, 'results': None}
+
+	checksum = hashlib.sha256()
+	with open(results_file, 'rb') as f:
+		# Check that the part we parsed before hasn't changed
+		offset = cache['offset']
+		if cache['results'] is not None and os.fstat(f.fileno()).st_size >= offset:
+			remaining = offset
+			while remaining:
+				chunk = f.read(min(remaining, 1024 * 1024))
+				if not chunk:
+					break
+				
+				checksum.update(chunk)
+				remaining -= len(chunk)
+
+		if cache['results'] is None or checksum.hexdigest() != cache['checksum']:
+			checksum = hashlib.sha256()
+			f.seek(0)
+			offset = 0
+			cache['results'] = None
+
+		# Only parse complete lines, in case results are being added to the file as we read it
+		new = f.read()
+		new = new[:new.rfind(b'\n') + 1]
+
+	checksum.update(new)
+	results = cache['results']
+	if new or results is None:
+		new_results = read_results(io.BytesIO(new))
+		if results is not None:
+			results = pd.concat([results, new_results], ignore_index = True).astype(RESULTS_DTYPES)
+		else:
+			results = new_results
+
+		# Write to a temporary file first so an interrupted save doesn't leave a broken cache
+		pd.to_pickle({'offset': offset + len(new), 'checksum': checksum.hexdigest(), 'results': results}, f'{cache_file}.tmp')
+		os.replace(f'{cache_file}.tmp', cache_file)
+
+	return results
+
+def load_templates(workbook, use_cache = True):
+	'''
+	Reads every sheet of a workbook of transcription templates into a dict of data frames.
+	If use_cache, the sheets are saved to workbook + '.cache.pkl' and read from there
+	until the workbook's modification time or size changes.
+	'''
+	stat = os.stat(workbook)
+	key = (stat.st_mtime_ns, stat.st_size)
+	cache_file = f'{workbook}.cache.pkl'
+	if use_cache:
+		try:
+			cache = pd.read_pickle(cache_file)
+			if cache['key'] == key:
+				return cache['sheets']
+		except Exception:
+			pass
+
+	sheets = pd.read_excel(workbook, sheet_name = None)
+	if use_cache:
+		pd.to_pickle({'key': key, 'sheets': sheets}, f'{cache_file}.tmp')
+		os.replace(f'{cache_file}.tmp', cache_file)
+
+	return sheets
+
+def get_subject_groups(results, subject_ids, categories = ('Experiencer', 'Garden-Path')):
+	'''
+	Returns a dict mapping each subject id found in the results to a list of their groups for each category.
+	A subject's IP is the IP of the first row whose value is the subject id, and their group for a category
+	is the group on the second row with that IP and category. Builds the lookups in one pass over the results.
+	'''
+	subject_ips = results.loc[results.value.isin(subject_ids), ['value', 'IP']].drop_duplicates('value')
+	subject_ips = dict(zip(subject_ips.value, subject_ips.IP))
+	
+	rows = results.loc[results.category.isin(categories) & results.IP.isin(list(subject_ips.values())), ['IP', 'category', 'group']]
+	rows = rows.loc[rows.groupby(['IP', 'category'], observed = True).cumcount() == 1]
+	groups = dict(zip(zip(rows.IP, rows.category), rows.group))
+	
+	return {subject_id: [groups[(ip, category)] for category in categories] for subject_id, ip in subject_ips.items()}
+
+def convert_trim():
+	'''Main function. Unzips, converts, and trims the sound files, and sets up the transcription templates.'''
+	args = parser.parse_args()
+
+	if args.jobs < 1:
+		print('--jobs must be at least 1. Exiting...')
+		sys.exit(1)
+
+	# Figure out the sound directories
+	#if args.auto_transcribe:
+	#	auto_transcribe_directories = args.directories
 
-# Unzip the zip files if any exist, and use their filenames to get the groups
-zipfiles = [item for sublist in [[f'{directory}/{file}' for file in os.listdir(directory) if file.endswith('.zip')] for directory in args.directories] for item in sublist]
-if zipfiles:
-	for file in zipfiles:
-		with zipfile.ZipFile(file, 'r') as f:
-			print(f'\rExtracting {file}...', end = '', flush = True)
-			f.extractall(os.path.split(file)[0])
+	args.directories = args.directories.split(':')
 
-		if not args.dont_delete:
-			os.remove(file)
+	# Allow for wildcards
+	args.directories = [item for sublist in [glob.glob(directory) for directory in args.directories] for item in sublist]
 
-	print('\n', end = '')
+	# Unzip the zip files if any exist, and use their filenames to get the groups
+	zipfiles = [item for sublist in [[f'{directory}/{file}' for file in os.listdir(directory) if file.endswith('.zip')] for directory in args.directories] for item in sublist]
+	if zipfiles:
+		if not args.from_zip:
+			for file in map_jobs(partial(extract_zip, dont_delete = args.dont_delete), zipfiles, jobs = args.jobs):
+				print(f'\rExtracted {file}...', end = '', flush = True)
 
-	#if args.auto_transcribe:
-	subject_ids = [os.path.split(file)[1] for file in zipfiles]
+			print('\n', end = '')
 
-	#	try:
-	#		# Get the newest results file
-	#		print('Downloading the latest results file...')
-	#		s = requests.Session()
-	#		pcibex_url = 'https://expt.pcibex.net'
-	#		s.get(f'{pcibex_url}/login')
-	#		with open('pw.txt', 'r') as f:
-	#			params = f.readlines()
+		#if args.auto_transcribe:
+		subject_ids = [os.path.split(file)[1] for file in zipfiles]
 
-	#		s.post(f'{pcibex_url}/login', data = {'username' : params[0][:-1], 'password' : params[1][:-1]})
-	#		results = s.get(f'{pcibex_url}/ajax/download/{params[2]}/results/results')
+		#	try:
+		#		# Get the newest results file
+		#		print('Downloading the latest results file...')
+		#		s = requests.Session()
+		#		pcibex_url = 'https://expt.pcibex.net'
+		#		s.get(f'{pcibex_url}/login')
+		#		with open('pw.txt', 'r') as f:
+		#			params = f.readlines()
 
-	#		with open('results.txt', 'wb') as file:
-	#			file.write(results.content)
-	#	except:
-	#		print('Unable to download latest results file. Groups will not be automatically determined if there are subjects not in the local version of the results file.')
+		#		s.post(f'{pcibex_url}/login', data = {'username' : params[0][:-1], 'password' : params[1][:-1]})
+		#		results = s.get(f'{pcibex_url}/ajax/download/{params[2]}/results/results')
 
-	if not args.no_groups:
-		# Load the results file
-		try:
-			results = pd.read_csv('results.txt', comment = '#',
-				names = ['time_rec', 'IP', 'controller', 'item_id', 'element', 'type', 'sub_experiment', 
-						 'element_type', 'element_name', 'parameter', 'value', 'event_time', 'category', 
-						 'group', 'item', 'sentence_type', 'relatedness', 'sentence', 'martrix_verb', 
-						 'prob1', 'prob2', 'prob3', 'prob4', 'wait1', 'wait2', 'wait3', 'wait4', 'comments'])
+		#		with open('results.txt', 'wb') as file:
+		#			file.write(results.content)
+		#	except:
+		#		print('Unable to download latest results file. Groups will not be automatically determined if there are subjects not in the local version of the results file.')
+
+		if not args.no_groups:
+			# Load the results file
+			try:
+				results = load_results('results.txt') if not args.no_cache else read_results('results.txt')
 				
-			# We have to use a for loop in case the results are not in the order of the subject identifiers
-			subject_ips = []
-			for subject_id in subject_ids:
-				subject_ips.append(results.loc[results.value == subject_id].IP.tolist()[0])
+				# Look up every subject at once in case the results are not in the order of the subject identifiers
+				subject_groups = get_subject_groups(results, subject_ids)
 				
-			if len(subject_ids) == len(subject_ips):
-				exp_groups = [results.loc[results.IP == subject_ip].loc[results.category == 'Experiencer'].iloc[1,:].group for subject_ip in subject_ips]
-				gp_groups = [results.loc[results.IP == subject_ip].loc[results.category == 'Garden-Path'].iloc[1,:].group for subject_ip in subject_ips]
-				args.groups_list = ':'.join([','.join([exp, gp]) for (exp, gp) in list(zip(exp_groups, gp_groups))])
-			else:
-				print('Warning: number of zipfiles and subjects do not match. Groups will not be determined.')
+				if all(subject_id in subject_groups for subject_id in subject_ids):
+					args.groups_list = ':'.join([','.join(subject_groups[subject_id]) for subject_id in subject_ids])
+				else:
+					print('Warning: number of zipfiles and subjects do not match. Groups will not be determined.')
+					args.groups_list = ''
+			except:
+				print('Unable to load latest results file. Groups will not be determined.')
 				args.groups_list = ''
-		except:
-			print('Unable to load latest results file. Groups will not be determined.')
-			args.groups_list = ''
-		
-files = [item for sublist in [[f'{directory}/{file}' for file in os.listdir(directory) if file.endswith('.webm')] for directory in args.directories] for item in sublist]
-
-#if args.experiencer_only:
-#	unneeded = [file for file in files if re.search('([1-6][0-9]])|(7[0-4])', os.path.split(file)[1])]
-#	files = [file for file in files if not file in unneeded]
-#
-#	# Get rid of the unneeded groups so we don't create an unnecessary csv
-#	groups = [groups.split(',') for groups in args.groups_list.split(':')]
-#	args.groups_list = ':'.join([','.join(subj_groups[:-1] + ['']) if len(subj_groups) == 3 else ','.join(subj_groups) for subj_groups in groups])
-#
-#	if not args.dont_delete:
-#		for file in unneeded:
-#			success = False
-#			while not success:
-#				try:
-#					os.remove(file)
-#					success = True
-#				except:
-#					pass
-
-#if args.controlraising_only:
-#	unneeded = [file for file in files if re.search(r'(^[1-9]{1}\.)|([1-3][0-9])|(4[0-8])', os.path.split(file)[1])]
-#	files = [file for file in files if not file in unneeded]
-#
-#	# Get rid of the unneeded groups so we don't create an unneccesary csv
-#	groups = [groups.split(',') for groups in args.groups_list.split(':')]
-#	args.groups_list = ':'.join([','.join(['', '', subj_groups[-1]]) if len(subj_groups) == 3 else subj_groups for subj_groups in groups])
-#	
-#	if not args.dont_delete:
-#		for file in unneeded:
-#			success = False
-#			while not success:
-#				try:
-#					os.remove(file)
-#					success = True
-#				except:
-#					pass
-
-if not files:
-	print('No files found to convert. Exiting...')
-	sys.exit(1)
-
-for f in files:
-	print(f'\rConverting and trimming {f}...', end = '', flush = True)
-
-	# Read in the sound file
-	sound = AudioSegment.from_file(f)
-
-	# Trim if we're doing that
-	if not args.convert_only:
-
-		# Find the stimulus number
-		num = int(re.search(r'^[1-9][0-9]?', os.path.split(f)[1]).group())
 		
-		# Only trim if the sound is long enough
-		if len(sound) > 10000:
+	files = [item for sublist in [[f'{directory}/{file}' for file in os.listdir(directory) if file.endswith('.webm')] for directory in args.directories] for item in sublist]
+
+	#if args.experiencer_only:
+	#	unneeded = [file for file in files if re.search('([1-6][0-9]])|(7[0-4])', os.path.split(file)[1])]
+	#	files = [file for file in files if not file in unneeded]
+	#
+	#	# Get rid of the unneeded groups so we don't create an unnecessary csv
+	#	groups = [groups.split(',') for groups in args.groups_list.split(':')]
+	#	args.groups_list = ':'.join([','.join(subj_groups[:-1] + ['']) if len(subj_groups) == 3 else ','.join(subj_groups) for subj_groups in groups])
+	#
+	#	if not args.dont_delete:
+	#		for file in unneeded:
+	#			success = False
+	#			while not success:
+	#				try:
+	#					os.remove(file)
+	#					success = True
+	#				except:
+	#					pass
+
+	#if args.controlraising_only:
+	#	unneeded = [file for file in files if re.search(r'(^[1-9]{1}\.)|([1-3][0-9])|(4[0-8])', os.path.split(file)[1])]
+	#	files = [file for file in files if not file in unneeded]
+	#
+	#	# Get rid of the unneeded groups so we don't create an unneccesary csv
+	#	groups = [groups.split(',') for groups in args.groups_list.split(':')]
+	#	args.groups_list = ':'.join([','.join(['', '', subj_groups[-1]]) if len(subj_groups) == 3 else subj_groups for subj_groups in groups])
+	#	
+	#	if not args.dont_delete:
+	#		for file in unneeded:
+	#			success = False
+	#			while not success:
+	#				try:
+	#					os.remove(file)
+	#					success = True
+	#				except:
+	#					pass
+
+	# If we're not extracting the zip files, find the webm files in them (extracting would put them in the directory itself)
+	members = []
+	if args.from_zip:
+		for file in zipfiles:
+			with zipfile.ZipFile(file, 'r') as f:
+				members.extend([(file, name) for name in f.namelist() if name.endswith('.webm') and not '/' in name])
+
+	if not files and not members:
+		print('No files found to convert. Exiting...')
+		sys.exit(1)
+
+	convert = partial(convert_file, convert_only = args.convert_only, dont_delete = args.dont_delete)
+	for f in map_jobs(convert, files, jobs = args.jobs):
+		print(f'\rConverted {f}...', end = '', flush = True)
+
+	for f in map_jobs(partial(convert_zip_member, convert_only = args.convert_only), members, jobs = args.jobs):
+		print(f'\rConverted {f}...', end = '', flush = True)
 
-			# If item number is 1, 4, 7, etc. then there are two nonce words (+100 ms buffer)
-			if num % 3 == 1:
-				sound = sound[4100:]
-
-			# If item number is 2, 5, 8, etc. then there are three nonce words (+50 ms buffer)
-			if num % 3 == 2:
-				sound = sound[6050:]
-
-			# If item number is 3, 6, 9, etc. then there are four nonce words (no buffer)
-			if num % 3 == 0:
-				sound = sound[8000:]
+	print('\n', end = '')
 
-			directory = f'{os.path.split(f)[0]}/'
+	# Every webm file in the zip files has been converted, so we don't need them anymore
+	if args.from_zip and not args.dont_delete:
+		for file in zipfiles:
+			remove_file(file)
 
-		# Export the trimmed sound
-		sound.export(directory + str(num) + "_trimmed.mp3", format = 'mp3')
-	# Otherwise, just convert the audio
-	else:
-		sound.export(directory + '/' + os.path.splitext(os.path.basename(f))[0] + '.mp3', format = 'mp3')
+	# Call the auto_trancribe script if we want that
+	#if args.auto_transcribe:
+	#	os.system(f'python auto_transcribe.py {auto_transcribe_directories} {args.groups_list}')
 
-	if not args.dont_delete:
-		success = False
-		while not success:
-			try:
-				os.remove(f)
-				success = True
-			except:
-				pass
-
-# Call the auto_trancribe script if we want that
-#if args.auto_transcribe:
-#	os.system(f'python auto_transcribe.py {auto_transcribe_directories} {args.groups_list}')
-
-# If we are getting groups, places files into the appropriate directories and add transcription templates
-if not args.no_groups:
-	# Get the groups for each subject
-	groups_list = args.groups_list.split(':')
-
-	# Iterate through the groups and directories for each subject
-	for groups, directory in tuple(zip(groups_list, args.directories)):
-
-		# Get the mp3 files
-		files = [f for f in os.listdir(directory) if f.endswith('.mp3')]
-
-		# Create directories and move files to the corresponding directories
-		if not os.path.isdir(f'{directory}/Experiencer'): os.makedirs(f'{directory}/Experiencer')
-		if not os.path.isdir(f'{directory}/Garden-Path'): os.makedirs(f'{directory}/Garden-Path')
-		for mp3 in files:
-			if re.findall(r'^([1-9]\_|[1-2][0-9]\_|3[0-2]\_)', mp3):
-				os.rename(f'{directory}/{mp3}', f'{directory}/Experiencer/{mp3}')
-			elif re.findall(r'^(3[3-9]\_|[4-5][0-9]\_|6[0-4]\_)', mp3):
-				os.rename(f'{directory}/{mp3}', f'{directory}/Garden-Path/{mp3}')
-
-		# Save CSV files with the transcription templates for each group
-		exp_group = groups.split(',')[0]
-		gp_group = groups.split(',')[1]
-
-		exp_template = pd.read_excel('groups_exp.xlsx', sheet_name = f'Group {exp_group}')
-		exp_template['Subject'] = re.sub('S', '', os.path.split(directory)[-1])
-		exp_template = exp_template.reindex(columns = (['Group', 'Subject'] + list([a for a in exp_template.columns if not a in ['Group', 'Subject']])))
-		exp_template.to_csv(f'{directory}/Experiencer/{os.path.split(directory)[-1]}_exp.csv', index = False)
-
-		gp_template = pd.read_excel('groups_garden-path.xlsx', sheet_name = f'Group {gp_group}')
-		gp_template['Subject'] = re.sub('S', '', os.path.split(directory)[-1])
-		gp_template = gp_template.reindex(columns = (['Group', 'Subject'] + list([a for a in gp_template.columns if not a in ['Group', 'Subject']])))
-		gp_template.to_csv(f'{directory}/Garden-Path/{os.path.split(directory)[-1]}_gp.csv', index = False)
\ No newline at end of file
+	# If we are getting groups, places files into the appropriate directories and add transcription templates
+	if not args.no_groups:
+		# Get the groups for each subject
+		groups_list = args.groups_list.split(':')
+
+		# Read in all the groups' templates once
+		exp_templates = load_templates('groups_exp.xlsx', use_cache = not args.no_cache)
+		gp_templates = load_templates('groups_garden-path.xlsx', use_cache = not args.no_cache)
+
+		# Iterate through the groups and directories for each subject
+		for groups, directory in tuple(zip(groups_list, args.directories)):
+
+			# Get the mp3 files
+			files = [f for f in os.listdir(directory) if f.endswith('.mp3')]
+
+			# Create directories and move files to the corresponding directories
+			if not os.path.isdir(f'{directory}/Experiencer'): os.makedirs(f'{directory}/Experiencer')
+			if not os.path.isdir(f'{directory}/Garden-Path'): os.makedirs(f'{directory}/Garden-Path')
+			for mp3 in files:
+				if re.findall(r'^([1-9]\_|[1-2][0-9]\_|3[0-2]\_)', mp3):
+					os.rename(f'{directory}/{mp3}', f'{directory}/Experiencer/{mp3}')
+				elif re.findall(r'^(3[3-9]\_|[4-5][0-9]\_|6[0-4]\_)', mp3):
+					os.rename(f'{directory}/{mp3}', f'{directory}/Garden-Path/{mp3}')
+
+			# Save CSV files with the transcription templates for each group
+			exp_group = groups.split(',')[0]
+			gp_group = groups.split(',')[1]
+
+			exp_template = exp_templates[f'Group {exp_group}'].copy()
+			exp_template['Subject'] = re.sub('S', '', os.path.split(directory)[-1])
+			exp_template = exp_template.reindex(columns = (['Group', 'Subject'] + list([a for a in exp_template.columns if not a in ['Group', 'Subject']])))
+			exp_template.to_csv(f'{directory}/Experiencer/{os.path.split(directory)[-1]}_exp.csv', index = False)
+
+			gp_template = gp_templates[f'Group {gp_group}'].copy()
+			gp_template['Subject'] = re.sub('S', '', os.path.split(directory)[-1])
+			gp_template = gp_template.reindex(columns = (['Group', 'Subject'] + list([a for a in gp_template.columns if not a in ['Group', 'Subject']])))
+			gp_template.to_csv(f'{directory}/Garden-Path/{os.path.split(directory)[-1]}_gp.csv', index = False)
+
+if __name__ == '__main__':
+	convert_trim()
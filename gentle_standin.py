@@ -0,0 +1,237 @@
+# gentle_standin.py by Michael Wilson
+# A stand-in for gentle that can be used to test and benchmark align.py without Docker or real audio
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+
+from typing import *
+from email.parser import BytesParser
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(
+	description=(
+		"Serves gentle's /transcriptions API, returning synthetic alignments "
+		"for whatever transcription is uploaded. The audio is ignored."
+	)
+)
+parser.add_argument(
+	'-p', '--port', default=8765, type=int,
+	help='Optional argument to specify the port to listen on. Default is 8765.'
+)
+parser.add_argument(
+	'-l', '--latency', default=0., type=float,
+	help='Optional argument to specify how long each alignment takes in seconds. Default is 0.'
+)
+parser.add_argument(
+	'-j', '--jitter', default=0., type=float,
+	help=(
+		'Optional argument to specify how much random extra time (in seconds, uniformly distributed '
+		'between 0 and this) is added to each alignment. Default is 0.'
+	)
+)
+parser.add_argument(
+	'-u', '--unaligned', default=0., type=float,
+	help=(
+		'Optional argument to specify the proportion of words that are reported as not found '
+		'in the audio. Default is 0.'
+	)
+)
+parser.add_argument(
+	'-e', '--errors', default=0., type=float,
+	help='Optional argument to specify the proportion of alignments that fail with a server error (500). Default is 0.'
+)
+parser.add_argument(
+	'--stalls', default=0., type=float,
+	help=(
+		'Optional argument to specify the proportion of alignments that take --stall_time seconds longer '
+		'than usual, to test timeouts and hedging. Default is 0.'
+	)
+)
+parser.add_argument(
+	'--stall_time', default=60., type=float,
+	help='Optional argument to specify how much longer stalled alignments take in seconds. Default is 60.'
+)
+parser.add_argument(
+	'-s', '--seed', default=None, type=int,
+	help='Optional argument to specify a random seed, to make the alignments reproducible.'
+)
+
+def make_alignment(transcript: str, rng: random.Random, unaligned: float = 0.) -> Dict:
+	'''
+	Makes a synthetic alignment with the same structure as gentle's output.
+	Each word is given a plausible onset and offset, with short pauses between words.
+	'''
+	words = []
+	position = round(rng.uniform(0.05, 0.5), 2)
+	for match in re.finditer(r"[\w']+", transcript):
+		word = {
+			'case': 'success',
+			'endOffset': match.end(),
+			'startOffset': match.start(),
+			'word': match.group(),
+		}
+		
+		duration = round(rng.uniform(0.1, 0.2) + 0.04 * len(match.group()), 2)
+		if rng.random() < unaligned:
+			word['case'] = 'not-found-in-audio'
+		else:
+			word.update({
+				'alignedWord': match.group().lower(),
+				'start': position,
+				'end': round(position + duration, 2),
+				'phones': [{'duration': duration, 'phone': 'sil'}],
+			})
+		
+		words.append(word)
+		position = round(position + duration + rng.uniform(0, 0.1), 2)
+	
+	return {'transcript': transcript, 'words': words}
+
+class GentleStandinHandler(BaseHTTPRequestHandler):
+	'''
+	Answers requests the way gentle does, with synthetic alignments.
+	With async=true, POSTs are redirected to a job whose status.json and align.json can be polled.
+	'''
+	def log_message(self, format: str, *args) -> None:
+		# don't log every request
+		pass
+	
+	def send_body(self, body: bytes, status: int = 200, content_type: str = 'application/json') -> None:
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+	
+	def read_upload(self) -> Dict[str,bytes]:
+		'''Reads the multipart form data sent to /transcriptions.'''
+		length = int(self.headers.get('Content-Length', 0))
+		body = self.rfile.read(length)
+		message = BytesParser().parsebytes(
+			f'Content-Type: {self.headers.get("Content-Type")}\r\n\r\n'.encode() + body
+		)
+		
+		return {
+			part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+			for part in message.get_payload()
+		}
+	
+	def do_GET(self) -> None:
+		path = urlparse(self.path).path
+		if path == '/':
+			self.send_body(b'<html><body>gentle stand-in</body></html>', content_type='text/html')
+			return
+		
+		# asynchronous jobs: /transcriptions/<id>/status.json and /transcriptions/<id>/align.json
+		match = re.match(r'^/transcriptions/([0-9a-f]+)/(status|align)\.json$', path)
+		with self.server.lock:
+			job = self.server.jobs.get(match.group(1)) if match else None
+		
+		if job is None:
+			self.send_body(b'Not found', status=404, content_type='text/plain')
+			return
+		
+		done = time.monotonic() >= job['ready']
+		if match.group(2) == 'status':
+			self.send_body(json.dumps({'status': 'OK' if done else 'ALIGNING'}).encode('utf-8'))
+		elif done:
+			self.send_body(json.dumps(job['alignment'], indent=2).encode('utf-8'))
+		else:
+			self.send_body(b'Not found', status=404, content_type='text/plain')
+	
+	def do_POST(self) -> None:
+		if urlparse(self.path).path.rstrip('/') != '/transcriptions':
+			self.send_body(b'Not found', status=404, content_type='text/plain')
+			return
+		
+		try:
+			upload = self.read_upload()
+			transcript = upload['transcript'].decode('utf-8')
+		except (KeyError, AttributeError, TypeError, UnicodeDecodeError):
+			self.send_body(b'Bad request', status=400, content_type='text/plain')
+			return
+		
+		is_async = parse_qs(urlparse(self.path).query).get('async', ['false'])[0] == 'true'
+		server = self.server
+		with server.lock:
+			alignment = make_alignment(transcript, rng=server.rng, unaligned=server.unaligned)
+			delay = server.latency + server.rng.uniform(0, server.jitter)
+			failed = server.rng.random() < server.errors
+			if server.rng.random() < server.stalls:
+				delay += server.stall_time
+			
+			# like gentle, redirect to the job instead of waiting if we're asked to
+			if is_async:
+				uid = f'{len(server.jobs):08x}'
+				server.jobs[uid] = {'alignment': alignment, 'ready': time.monotonic() + delay}
+		
+		if failed:
+			time.sleep(delay)
+			self.send_body(b'Internal server error', status=500, content_type='text/plain')
+			return
+		
+		if is_async:
+			self.send_response(302)
+			self.send_header('Location', f'/transcriptions/{uid}')
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		
+		time.sleep(delay)
+		self.send_body(json.dumps(alignment, indent=2).encode('utf-8'))
+
+def make_server(
+	port: int = 8765,
+	latency: float = 0.,
+	jitter: float = 0.,
+	unaligned: float = 0.,
+	errors: float = 0.,
+	stalls: float = 0.,
+	stall_time: float = 60.,
+	seed: int = None
+) -> ThreadingHTTPServer:
+	'''Makes a stand-in gentle server. Call serve_forever() on it (in a thread if needed) to start it.'''
+	server = ThreadingHTTPServer(('localhost', port), GentleStandinHandler)
+	server.daemon_threads = True
+	server.latency = latency
+	server.jitter = jitter
+	server.unaligned = unaligned
+	server.errors = errors
+	server.stalls = stalls
+	server.stall_time = stall_time
+	server.rng = random.Random(seed)
+	server.lock = threading.Lock()
+	server.jobs = {}
+	return server
+
+def start_server(**kwargs) -> ThreadingHTTPServer:
+	'''Starts a stand-in gentle server in a background thread. Call shutdown() on it to stop it.'''
+	server = make_server(**kwargs)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+if __name__ == '__main__':
+	args = parser.parse_args()
+	server = make_server(
+		port=args.port,
+		latency=args.latency,
+		jitter=args.jitter,
+		unaligned=args.unaligned,
+		errors=args.errors,
+		stalls=args.stalls,
+		stall_time=args.stall_time,
+		seed=args.seed
+	)
+	log.info(f'gentle stand-in listening on http://localhost:{args.port}')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass